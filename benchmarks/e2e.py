@@ -0,0 +1,307 @@
+"""
+End-to-end benchmark of the hot paths on the dummy datasets against a local fake LLM server
+(`benchmarks.fake_llm`), so results depend on this code and not on a model.
+
+Measures `Environment.reset`, `Store.update`, every retriever, `Sampler.__call__`,
+`runner_host.generate_patch` and `Environment.step` in isolation, and whole episodes (reset, sample,
+step) end-to-end. Prints a JSON report with throughput and p50/p90/p99 latencies per stage, to
+compare between commits. Stages that cannot run here (no docker, no embedding model, ...) are
+reported as skipped with the reason. With `--runner local`, tests run without docker.
+
+Usage: python -m benchmarks.e2e [--dataset dummy] [--repeat 10] [--latency-ms 50]
+    [--runner docker] [--git-mirror "/mirrors/{repo}.git"] [--output report.json] [--trace trace.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from benchmarks.fake_llm import FakeLLMServer
+from se_gym import api, config, observe, runner_host, sampler2, tracing
+
+RETRIEVERS = ("bm25", "embedding", "hybrid", "full", "oracle", "codemap")
+PROMPT = "You are a software engineer. Fix the issue by changing as little code as possible."
+
+
+class Skipped(Exception):
+    pass
+
+
+def summarize(seconds: list) -> dict:
+    seconds = np.asarray(seconds, dtype=float)
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000
+    return dict(
+        n=len(seconds),
+        mean_ms=round(float(seconds.mean()) * 1000, 3),
+        p50_ms=round(float(p50), 3),
+        p90_ms=round(float(p90), 3),
+        p99_ms=round(float(p99), 3),
+        throughput_per_s=round(len(seconds) / float(seconds.sum()), 3) if seconds.sum() else None,
+    )
+
+
+def measure(report: dict, name: str, func, repeat: int, setup=None):
+    """
+    Time `func(setup())` `repeat` times and add the summary to the report. A failing stage is
+    reported as skipped, so one missing dependency does not hide the other stages.
+    """
+    seconds, result = [], None
+    try:
+        for _ in range(repeat):
+            arg = setup() if setup is not None else None
+            start = time.perf_counter()
+            result = func(arg)
+            seconds.append(time.perf_counter() - start)
+    except Exception as e:
+        reason = str(e) if isinstance(e, Skipped) else f"{type(e).__name__}: {e}"
+        report[name] = dict(skipped=reason.strip().splitlines()[0] if reason.strip() else reason)
+        print(f"{name}: skipped ({report[name]['skipped']})", file=sys.stderr)
+        if not isinstance(e, Skipped):
+            print(traceback.format_exc(), file=sys.stderr)
+        return None
+    report[name] = summarize(seconds)
+    print(f"{name}: {report[name]}", file=sys.stderr)
+    return result
+
+
+def make_state(dataset: dict, index: int) -> api.State:
+    """
+    The state `Environment.reset(index)` would return, without needing docker.
+    """
+    row = {k: v[index] for k, v in dataset.items()}
+    try:
+        path = runner_host.HostEnv.get_environment(row["repo"], row["environment_setup_commit"])
+    except OSError as e:  # the clone failed, so there is no repo to reset
+        raise Skipped(f"could not clone {row['repo']}, try --git-mirror") from e
+    if not os.path.isdir(os.path.join(path, "repo", ".git")):
+        raise Skipped(f"could not clone {row['repo']}, try --git-mirror")
+    return api.State(
+        path=path,
+        issue=row["problem_statement"],
+        fail_to_pass=[],
+        previous_patches=[row["test_patch"]],
+        repo=row["repo"],
+        setup_commit=row["environment_setup_commit"],
+    )
+
+
+def make_patch(state: api.State, oracle_files: list) -> dict:
+    """
+    A canned patch that always applies: a comment appended to an import line, preferring the oracle
+    files of the issue.
+    """
+    root = os.path.join(state.path, "repo")
+    files = [f for f in oracle_files if os.path.isfile(os.path.join(root, f))]
+    files += sorted(
+        os.path.relpath(os.path.join(d, f), root)
+        for d, _, names in os.walk(root)
+        if ".git" not in d.split(os.sep)
+        for f in names
+        if f.endswith(".py")
+    )
+    fallback = None
+    for file in files:
+        with open(os.path.join(root, file), "r") as f:
+            lines = [line.rstrip("\n") for line in f if line.strip()]
+        for line in lines:
+            if line.startswith(("import ", "from ")):
+                return dict(filename=file, old_code=line, new_code=line + "  # benchmark")
+        if lines and fallback is None:
+            fallback = dict(filename=file, old_code=lines[-1], new_code=lines[-1] + "  # benchmark")
+    if fallback is None:
+        raise Skipped("no Python file to patch")
+    return fallback
+
+
+def make_environment(dataset: dict, runner: str):
+    try:
+        return api.Environment(dataset, runner=runner), None
+    except Exception as e:  # e.g. docker is not running
+        return None, f"{runner} runner unavailable ({type(e).__name__}: {e})"
+
+
+def run(args, server: FakeLLMServer) -> dict:
+    dataset = api.get_ds(args.dataset)
+    oracle = api.Environment._parse_oracle_text(dataset["text"][args.index])
+    issue = dataset["problem_statement"][args.index]
+    stages = {}
+
+    env, no_env = make_environment(dataset, args.runner)
+    if env is None:
+        for name in ("reset_cold", "reset", "step", "episode"):
+            stages[name] = dict(skipped=no_env)
+    else:
+
+        def cold():
+            runner_host.HostEnv._environments.clear()  # clone again
+            env._module_indexes.clear()
+
+        def reset(_):
+            try:
+                state = env.reset(args.index)
+            except OSError as e:  # the clone failed, so there is no repo to reset
+                raise Skipped(f"could not clone {env.current_repo}, try --git-mirror") from e
+            if not os.path.isdir(os.path.join(state.path, "repo", ".git")):
+                raise Skipped(f"could not clone {state.repo}, try --git-mirror")
+            return state
+
+        measure(stages, "reset_cold", reset, min(args.repeat, 3), setup=cold)
+        measure(stages, "reset", reset, args.repeat)
+
+    try:
+        state = make_state(dataset, args.index)
+        server.patch = make_patch(state, oracle)
+    except Skipped as e:
+        for name in ("store_update", "sampler", "generate_patch", "step", "episode"):
+            stages.setdefault(name, dict(skipped=str(e)))
+        return stages
+
+    measure(
+        stages,
+        "store_update",
+        lambda store: store.update(state),
+        args.repeat,
+        setup=lambda: observe.Store(converter=args.converter, retriever="bm25"),
+    )
+    store = observe.Store(converter=args.converter, retriever="bm25")
+    store.update(state)
+    measure(stages, "store_update_unchanged", lambda _: store.update(state), args.repeat)
+
+    for retriever in args.retrievers:
+        try:
+            store = observe.Store(converter=args.converter, retriever=retriever)
+        except Exception as e:
+            stages[f"update/{retriever}"] = stages[f"retrieve/{retriever}"] = dict(
+                skipped=f"{type(e).__name__}: {e}"
+            )
+            continue
+        if retriever == "oracle":
+            store.retriever.set_oracle_files(oracle)
+        if measure(stages, f"update/{retriever}", lambda _: store.update(state) or True, 1):
+
+            def retrieve(_):
+                store.invalidate()  # measure the retriever, not the cached results
+                return store.retrieve(issue)
+
+            measure(stages, f"retrieve/{retriever}", retrieve, args.repeat)
+        else:
+            stages[f"retrieve/{retriever}"] = dict(skipped=f"update/{retriever} failed")
+
+    sampler = sampler2.Sampler(store=observe.Store(converter=args.converter, retriever="bm25"))
+    timings = []
+
+    def sample(_):
+        action = sampler(PROMPT, state)
+        timings.append(action.timings)
+        return action
+
+    action = measure(stages, "sampler", sample, args.repeat)
+    if timings:
+        stages["sampler"]["stages_mean_ms"] = {
+            k: round(float(np.mean([t.get(k, 0.0) for t in timings])) * 1000, 3)
+            for k in timings[-1]
+        }
+    measure(
+        stages,
+        "generate_patch",
+        lambda _: runner_host.generate_patch(
+            state.repo, state.setup_commit, state.previous_patches, **server.patch
+        ),
+        args.repeat,
+    )
+
+    if env is not None:
+        if not action:
+            stages["step"] = stages["episode"] = dict(skipped="the sampler produced no patch")
+            return stages
+        measure(stages, "step", lambda _: env.step(action, state), args.repeat)
+
+        def episode(_):
+            s = env.reset(args.index)
+            return env.step(sampler(PROMPT, s), s)
+
+        measure(stages, "episode", episode, args.repeat)
+    return stages
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", default="dummy", choices=["dummy", "dummy2"])
+    parser.add_argument("--index", type=int, default=0, help="row of the dataset")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="of the fake LLM")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--converter", default="txt")
+    parser.add_argument("--runner", default=config.RUNNER, choices=["docker", "local"])
+    parser.add_argument("--retrievers", nargs="+", default=list(RETRIEVERS), choices=RETRIEVERS)
+    parser.add_argument(
+        "--git-mirror", help="template of the clone URL, e.g. /mirrors/{repo}.git (no network)"
+    )
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--trace", help="also write a Chrome trace of all stages to this file")
+    args = parser.parse_args()
+
+    if args.git_mirror:
+        config.GIT_URL_TEMPLATE = args.git_mirror
+    cache_dir = tempfile.mkdtemp(prefix="se_gym_benchmark_cache_")
+    config.CACHE_DIR = cache_dir  # start cold and do not touch the user's cache
+    try:
+        with FakeLLMServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000) as server:
+            for model_config in (
+                config.MODEL_CONFIG,
+                config.EVO_MODEL_CONFIG,
+                config.RETRIEVER_MODEL_CONFIG,
+            ):
+                model_config.update(base_url=server.base_url, api_key="no-key", model_name="fake")
+            start = time.perf_counter()
+            if args.trace:
+                with tracing.session(args.trace):
+                    stages = run(args, server)
+            else:
+                stages = run(args, server)
+            report = dict(
+                commit=git_commit(),
+                timestamp=time.time(),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                dataset=args.dataset,
+                index=args.index,
+                runner=args.runner,
+                repeat=args.repeat,
+                latency_ms=args.latency_ms,
+                jitter_ms=args.jitter_ms,
+                converter=args.converter,
+                llm_requests=server.num_requests,
+                total_seconds=round(time.perf_counter() - start, 3),
+                stages=stages,
+            )
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Local fake of an OpenAI compatible chat completions API for benchmarks. Every request is answered
+after a configurable latency with a canned response that is valid for the requested JSON schema:
+
+- a patch (schema with `filename`, `old_code` and `new_code`) returns `FakeLLMServer.patch`,
+- any other schema returns the first allowed value of every field, e.g. the first selectable file
+  of a code map directory,
+- requests without a schema (code map summaries) return a short text.
+
+Usage: python -m benchmarks.fake_llm [--port 8000] [--latency-ms 0] [--jitter-ms 0]
+"""
+
+import argparse
+import http.server
+import json
+import random
+import threading
+import time
+import typing
+
+PATCH_FIELDS = {"filename", "old_code", "new_code"}
+SUMMARY = "Defines `main` and helper functions used by the rest of the package."
+
+
+def example(schema: dict, defs: typing.Optional[dict] = None):
+    """
+    The simplest value that is valid for a JSON schema as generated by pydantic.
+    """
+    defs = schema.get("$defs", defs or {})
+    if "$ref" in schema:
+        return example(defs[schema["$ref"].split("/")[-1]], defs)
+    if "const" in schema:
+        return schema["const"]
+    if schema.get("enum"):
+        return schema["enum"][0]
+    for key in ("anyOf", "oneOf", "allOf"):
+        if schema.get(key):
+            return example(schema[key][0], defs)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: example(s, defs) for name, s in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [example(schema["items"], defs)] if "items" in schema else []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return "benchmark"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        body = json.dumps(self.server.fake.complete(request)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # keep the benchmark output clean
+        pass
+
+
+class FakeLLMServer:
+    """
+    Fake chat completions server running in a background thread. Use as a context manager and point
+    the model configs at `base_url`. `patch` can be changed at any time, e.g. per repository.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        patch: typing.Optional[typing.Dict[str, str]] = None,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.patch = patch
+        self.num_requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def content(self, request: dict) -> str:
+        response_format = request.get("response_format") or {}
+        schema = response_format.get("json_schema", {}).get("schema") or response_format.get(
+            "schema"
+        )
+        if schema is None:
+            return SUMMARY
+        if self.patch is not None and PATCH_FIELDS <= set(schema.get("properties", {})):
+            return json.dumps(self.patch)
+        return json.dumps(example(schema))
+
+    def complete(self, request: dict) -> dict:
+        with self._lock:
+            self.num_requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        time.sleep(delay)
+        content = self.content(request)
+        prompt = "".join(str(m.get("content", "")) for m in request.get("messages", []))
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        return {
+            "id": f"chatcmpl-fake-{self.num_requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-llm", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeLLMServer(
+        args.host, args.port, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000
+    )
+    print(f"Serving a fake LLM at {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
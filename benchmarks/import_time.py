@@ -0,0 +1,69 @@
+"""
+Import time benchmark with a regression budget.
+
+Imports each module in a fresh interpreter (several times, reporting the median), checks that no
+heavy dependency is loaded by modules that should not need it and prints a JSON report. Exits with
+status 1 if a budget is exceeded.
+
+Usage: python -m benchmarks.import_time [--repeat 5] [--scale 1.0]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# module -> budget in milliseconds
+BUDGETS_MS = {
+    "se_gym": 50,
+    "se_gym.testlog": 300,
+    "se_gym.tracing": 50,
+    "se_gym.fitness": 500,
+    "se_gym.checkpoint": 500,
+}
+HEAVY = ("haystack", "openai", "docker", "pandas", "pyarrow", "sentence_transformers")
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps(dict(seconds=seconds, heavy=[m for m in {heavy!r} if m in sys.modules])))
+"""
+
+
+def measure(module: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(module=module, heavy=HEAVY)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiply budgets on slow machines"
+    )
+    args = parser.parse_args()
+
+    report, failed = {}, False
+    for module, budget in BUDGETS_MS.items():
+        runs = [measure(module) for _ in range(args.repeat)]
+        median_ms = statistics.median(r["seconds"] for r in runs) * 1000
+        heavy = sorted({m for r in runs for m in r["heavy"]})
+        ok = median_ms <= budget * args.scale and not heavy
+        failed |= not ok
+        report[module] = dict(
+            median_ms=round(median_ms, 1), budget_ms=budget * args.scale, heavy=heavy, ok=ok
+        )
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
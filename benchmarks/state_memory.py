@@ -0,0 +1,116 @@
+"""
+Memory benchmark of state transitions over an episode.
+
+Reports the two effects of the `api.State` rework separately, each on identical inputs:
+
+- `payload`: memory of the test results of all steps as raw dictionaries vs `testlog.TestLog`.
+- `transitions`: deep copying the state on every step (the previous approach) vs the structurally
+  shared `State.with_log`, for both kinds of payloads. The payloads are created beforehand, so
+  only the memory of the transitions is measured.
+
+Prints a JSON report.
+
+Usage: python -m benchmarks.state_memory [--steps 20] [--tests 2000]
+"""
+
+import argparse
+import copy
+import json
+import random
+import time
+import tracemalloc
+
+from se_gym import api, testlog
+
+
+def make_results(num_tests: int, failure_rate: float, rng: random.Random) -> dict:
+    results = {}
+    for i in range(num_tests):
+        if rng.random() < failure_rate:
+            traceback = "".join(f'  File "module_{j}.py", line {j}, in f\n' for j in range(60))
+            results[f"tests.test_mod_{i // 50}.test_{i}"] = {
+                "status": "failed",
+                "message": traceback + f"AssertionError: {i} != {i + 1}",
+            }
+        else:
+            results[f"tests.test_mod_{i // 50}.test_{i}"] = {"status": "passed"}
+    return results
+
+
+def make_logs(results: list) -> list:
+    logs = []
+    for r in results:
+        logs.append(testlog.TestLog.from_results(r, previous=logs[-1] if logs else None))
+    return logs
+
+
+def run_deepcopy(initial: dict, logs: list) -> list:
+    """The previous transition: deepcopy the state and append the results."""
+    states = [initial]
+    for log in logs:
+        new_state = copy.deepcopy(states[-1])
+        new_state["logs"].append(log)
+        states.append(new_state)
+    return states
+
+
+def run_shared(initial: api.State, logs: list) -> list:
+    states = [initial]
+    for log in logs:
+        states.append(states[-1].with_log(log))
+    return states
+
+
+def measure(func, *args) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return dict(seconds=seconds, retained_bytes=current, peak_bytes=peak)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--tests", type=int, default=2000)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    def make_raw() -> list:
+        rng = random.Random(0)  # the same results on every call
+        return [make_results(args.tests, args.failure_rate, rng) for _ in range(args.steps)]
+
+    def make_compact() -> list:
+        return make_logs(make_raw())  # only retains what the test logs keep of the raw results
+
+    raw, compact = make_raw(), make_compact()
+    fields = dict(
+        repo="owner/repo",
+        setup_commit="0" * 40,
+        path="/tmp/repo",
+        issue="Issue text. " * 500,
+        previous_patches=["diff --git a/x.py b/x.py\n" + "+line\n" * 2000],
+    )
+    report = dict(
+        steps=args.steps,
+        tests=args.tests,
+        payload=dict(raw=measure(make_raw), testlog=measure(make_compact)),
+        transitions=dict(
+            raw=dict(
+                deepcopy=measure(run_deepcopy, dict(fields, logs=[]), raw),
+                shared=measure(run_shared, api.State(**fields), raw),
+            ),
+            testlog=dict(
+                deepcopy=measure(run_deepcopy, dict(fields, logs=[]), compact),
+                shared=measure(run_shared, api.State(**fields), compact),
+            ),
+        ),
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,87 @@
 # ruff: noqa: F401
 
+import importlib
 import os
+import typing
 
 os.environ["HAYSTACK_TELEMETRY_ENABLED"] = "false"
 os.environ["HAYSTACK_LOGGING_IGNORE_STRUCTLOG_ENV_VAR"] = "true"
 
-from . import fitness
-from .api import make
-from . import generators
-from .codemapretriever import CodeMapRetriever
-from . import genetic
-from . import config
-from . import observe
-from . import output_validator
-from . import runner_docker
-from . import runner_host
-from . import dummy_ds
-from .sampler2 import Sampler
-from . import utils
+_SUBMODULES = (
+    "api",
+    "archive",
+    "cache",
+    "checkpoint",
+    "codemapretriever",
+    "config",
+    "dummy_ds",
+    "embedding",
+    "experiment_log",
+    "fitness",
+    "generators",
+    "genetic",
+    "islands",
+    "observe",
+    "output_validator",
+    "packing",
+    "runner_docker",
+    "runner_host",
+    "runner_local",
+    "sampler2",
+    "testlog",
+    "tracing",
+    "utils",
+)
+_ATTRIBUTES = dict(make="api", CodeMapRetriever="codemapretriever", Sampler="sampler2")
+
+__all__ = [*_SUBMODULES, *_ATTRIBUTES]
+
+
+def __getattr__(name: str):
+    """
+    Import submodules and the shortcuts `make`, `CodeMapRetriever` and `Sampler` on first access, so
+    `import se_gym` stays fast and only the used parts load haystack, openai or docker.
+    """
+    if name in _ATTRIBUTES:
+        value = getattr(importlib.import_module(f".{_ATTRIBUTES[name]}", __name__), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if typing.TYPE_CHECKING:
+    from . import (
+        api,
+        archive,
+        cache,
+        checkpoint,
+        codemapretriever,
+        config,
+        dummy_ds,
+        embedding,
+        experiment_log,
+        fitness,
+        generators,
+        genetic,
+        islands,
+        observe,
+        output_validator,
+        packing,
+        runner_docker,
+        runner_host,
+        runner_local,
+        sampler2,
+        testlog,
+        tracing,
+        utils,
+    )
+    from .api import make
+    from .codemapretriever import CodeMapRetriever
+    from .sampler2 import Sampler
@@ -1,27 +1,31 @@
+import ast
+import collections
 import dataclasses
-
+import json
 import os
 import random
+import time
 import typing
 import logging
 import regex as re
-import copy
 
+from . import cache
 from . import config
 from . import runner_host
-from . import runner_docker
 from . import dummy_ds
+from . import testlog
+from . import tracing
 
 random.seed(15)
 logger = logging.getLogger(__name__)
-__all__ = ["make"]
-
-if not os.path.exists(config.DEFAULT_SAVE_PATH):
-    os.makedirs(config.DEFAULT_SAVE_PATH)
+__all__ = ["make", "Action", "Runner", "make_runner"]
 
 
-def make(dataset: str = "princeton-nlp/SWE-bench_Verified/dev"):
-    return Environment(get_ds(dataset))
+def make(
+    dataset: str = "princeton-nlp/SWE-bench_Verified/dev",
+    runner: typing.Union[str, "Runner", None] = None,
+):
+    return Environment(get_ds(dataset), runner=runner)
 
 
 def get_ds(dataset):
@@ -39,33 +43,131 @@ def get_ds(dataset):
         return datasets.load_dataset(dataset, split=split)
 
 
-@dataclasses.dataclass
+class Action(str):
+    """
+    A patch produced by a sampler. Behaves like the patch string, but also carries how it was
+    produced: `timings` (seconds per stage, e.g. `retrieval`, `generation`, `validation`) and
+    `retries` (number of invalid outputs of the model before the patch was accepted) and `usage`
+    (number of `prompt_tokens` and `completion_tokens`).
+    """
+
+    def __new__(
+        cls,
+        patch: str = "",
+        timings: typing.Optional[typing.Dict[str, float]] = None,
+        retries: int = 0,
+        usage: typing.Optional[typing.Dict[str, int]] = None,
+    ):
+        action = super().__new__(cls, patch)
+        action.timings = dict(timings or {})
+        action.retries = retries
+        action.usage = dict(usage or {})
+        return action
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
 class State:
+    """
+    Immutable state of an episode. Transitions create a new state that shares all unchanged fields
+    (and all previous patches and logs) with the old one, see `State.with_log`.
+    """
+
     repo: typing.Annotated[str, "Repository to be fixed"]
     setup_commit: typing.Annotated[str, "Base commit"]
     path: typing.Annotated[str, "Path to the repository"]
     issue: typing.Annotated[str, "Issue to be fixed"]
-    logs: typing.Annotated[typing.Union[str, None], "Logs of previous steps"] = ""
-    previous_patches: typing.Annotated[typing.List[str], "Previous patches"] = dataclasses.field(
-        default_factory=list
-    )
-    fail_to_pass: typing.Annotated[typing.List[str], "Tests that currently fails"] = (
-        dataclasses.field(default_factory=list)
-    )
+    logs: typing.Annotated[typing.Tuple[testlog.TestLog, ...], "Logs of previous steps"] = ()
+    previous_patches: typing.Annotated[typing.Tuple[str, ...], "Previous patches"] = ()
+    fail_to_pass: typing.Annotated[typing.Tuple[str, ...], "Tests that currently fails"] = ()
+    stats: typing.Annotated[typing.Tuple[dict, ...], "Timings and retries of previous steps"] = ()
 
+    def __post_init__(self):
+        for name in ("logs", "previous_patches", "fail_to_pass", "stats"):
+            value = getattr(self, name)
+            if not isinstance(value, tuple):
+                object.__setattr__(self, name, tuple(value) if value else ())
+
+    def with_log(self, log: testlog.TestLog, stats: typing.Optional[dict] = None) -> "State":
+        """
+        Return a new state with `log` appended to the logs (and `stats` to the stats).
+        """
+        if stats is None:
+            return dataclasses.replace(self, logs=self.logs + (log,))
+        return dataclasses.replace(self, logs=self.logs + (log,), stats=self.stats + (stats,))
+
+    def with_stats(self, stats: dict) -> "State":
+        """
+        Return a new state with `stats` appended to the stats.
+        """
+        return dataclasses.replace(self, stats=self.stats + (stats,))
+
+    @classmethod
+    def from_state(cls, state: "State") -> "State":
+        """
+        Create a state of this class sharing all fields with `state`.
+        """
+        return cls(**{f.name: getattr(state, f.name) for f in dataclasses.fields(State)})
 
+
+@dataclasses.dataclass(frozen=True, slots=True)
 class InvalidState(State):
     pass
 
 
+class Runner(typing.Protocol):
+    """
+    Runs the tests of a repository with patches applied, in a sandbox per job (e.g. a docker
+    container). Implemented by `runner_docker.DockerConnector` and `runner_local.LocalRunner`.
+    """
+
+    def start(self, repo: str, environment_setup_commit: str) -> typing.Any:
+        """
+        Create a sandbox with the repository checked out at the commit and return its job handle.
+        """
+
+    def apply_patch(self, job: typing.Any, patch: str):
+        """
+        Apply a patch in the sandbox, raising an exception if it does not apply.
+        """
+
+    def run_tests(self, job: typing.Any) -> dict:
+        """
+        Run the tests in the sandbox and return the results by test name.
+        """
+
+    def stop(self, job: typing.Any):
+        """
+        Remove the sandbox.
+        """
+
+
+def make_runner(name: str) -> Runner:
+    """
+    Create the runner `name`: "docker" (requires a running docker daemon) or "local".
+    """
+    if name == "docker":
+        from . import runner_docker  # delayed import to avoid slow startup
+
+        return runner_docker.DockerConnector()
+    elif name == "local":
+        from . import runner_local  # delayed import to avoid slow startup
+
+        return runner_local.LocalRunner()
+    raise NotImplementedError(f"Runner {name} not implemented")
+
+
 class Environment:
-    def __init__(self, dataset):
+    def __init__(self, dataset, runner: typing.Union[str, Runner, None] = None):
         """
         Initialize the environment with a dataset. If the dataset is not available, it will be downloaded lazily.
+        `runner` runs the tests, a `Runner` or its name (see `make_runner`), `config.RUNNER` by default.
         """
+        os.makedirs(config.DEFAULT_SAVE_PATH, exist_ok=True)
         self.dataset = dataset
-        self.dockerconnector = runner_docker.DockerConnector()
+        runner = config.RUNNER if runner is None else runner
+        self.runner = make_runner(runner) if isinstance(runner, str) else runner
         self.current_index = None
+        self.current_instance_id = None
         self.current_path = None
         self.current_issue = None
         self.current_fail_to_pass = None
@@ -75,32 +177,54 @@ class Environment:
         self.num_challenges = (  # helper to get the number of issues in the dataset
             self.dataset.num_rows
             if not isinstance(self.dataset, dict)
-            else len(self.dataset[list(self.dataset.keys())[0]])
+            else len(next(iter(self.dataset.values())))
         )
+        self._rows = collections.OrderedDict()
+        self._module_indexes = {}
 
+    def _get_row(self, index: int) -> typing.Dict[str, typing.Any]:
+        """
+        Read a single row of the dataset. Indexing a HuggingFace dataset by row only reads that row
+        from Arrow, while indexing by column would materialize the whole column. The most recently
+        used rows are cached, so memory stays flat when iterating over a full split.
+        """
+        if index in self._rows:
+            self._rows.move_to_end(index)
+            return self._rows[index]
+        if isinstance(self.dataset, dict):
+            row = {k: v[index] for k, v in self.dataset.items()}
+        else:
+            row = self.dataset[index]
+        self._rows[index] = row
+        if len(self._rows) > config.DATASET_ROW_CACHE_SIZE:
+            self._rows.popitem(last=False)
+        return row
+
+    @tracing.traced("env.reset")
     def reset(self, index: typing.Optional[int] = None) -> State:
         """
         Return a new instance of the selected environment.
         """
         if index is None:
-            len_ds = sum(1 for _ in self.dataset["instance_id"])
-            index = random.randint(0, len_ds - 1)
+            index = random.randint(0, self.num_challenges - 1)
         self.current_index = index
-        self.current_repo = self.dataset["repo"][self.current_index]
-        self.current_issue = self.dataset["problem_statement"][self.current_index]
-        self.current_commit = self.dataset["environment_setup_commit"][self.current_index]
-        test_patch = self.dataset["test_patch"][self.current_index]
+        row = self._get_row(index)
+        self.current_instance_id = str(row.get("instance_id", index))
+        self.current_repo = row["repo"]
+        self.current_issue = row["problem_statement"]
+        self.current_commit = row["environment_setup_commit"]
+        test_patch = row["test_patch"]
 
         self.current_path = runner_host.HostEnv.get_environment(
             self.current_repo, self.current_commit
         )
         self.current_fail_to_pass = self._parse_fail_to_pass(
-            self.dataset["FAIL_TO_PASS"][self.current_index], self.current_path
+            row["FAIL_TO_PASS"],
+            self.current_path,
+            self._get_module_index(self.current_repo, self.current_commit, self.current_path),
         )
         try:
-            self.current_oracle_files = self._parse_oracle_text(
-                self.dataset["text"][self.current_index]
-            )
+            self.current_oracle_files = self._parse_oracle_text(row["text"])
         except Exception:
             logger.info("No oracle files found", exc_info=True)
             self.current_oracle_files = []
@@ -113,33 +237,44 @@ class Environment:
             setup_commit=self.current_commit,
         )
 
+    @tracing.traced("env.step")
     def step(self, action: typing.Union[str, typing.List[str]], state) -> State:
         """
-        Perform an action in the environment.
+        Perform an action in the environment. The timings and retries of the action (see `Action`)
+        and the time spent testing it are appended to `State.stats`.
         """
         if isinstance(action, list):
-            return [self.step(a) for a in action]
+            return [self.step(a, state) for a in action]
+        timings = dict(getattr(action, "timings", {}))
+        stats = dict(
+            timings=timings,
+            retries=getattr(action, "retries", 0),
+            usage=dict(getattr(action, "usage", {})),
+        )
         if not action:  # Sampler has produced invalid patch
             logger.info("Invalid patch, skipping")
-            return InvalidState(**state.__dict__)
+            return InvalidState.from_state(state.with_stats(stats))
 
-        container = self.dockerconnector.get_child_container(
-            repo=self.current_repo,
-            environment_setup_commit=self.current_commit,
+        start = time.perf_counter()
+        job = self.runner.start(self.current_repo, self.current_commit)
+        timings["container"] = time.perf_counter() - start
+        try:
+            start = time.perf_counter()
+            for patch in state.previous_patches:
+                if patch and patch != "[]":
+                    self.runner.apply_patch(job, patch=patch)
+            self.runner.apply_patch(job, patch=action)
+            timings["apply_patches"] = time.perf_counter() - start
+            start = time.perf_counter()
+            log = self.runner.run_tests(job)
+            timings["tests"] = time.perf_counter() - start
+        finally:
+            self.runner.stop(job)
+        previous = state.logs[-1] if state.logs else None
+        log = testlog.TestLog.from_results(
+            log, previous=previous if isinstance(previous, testlog.TestLog) else None
         )
-        for patch in state.previous_patches:
-            if patch and patch != "[]":
-                self.dockerconnector.apply_patch(container, patch=patch)
-        self.dockerconnector.apply_patch(container, patch=action)
-        log = self.dockerconnector.run_tests(container)
-        container.kill()
-        new_state = copy.deepcopy(state)
-        if new_state.logs:
-            new_state.logs.append(log)
-        else:
-            new_state.logs = [log]
-
-        return new_state
+        return state.with_log(log, stats=stats)
 
     @staticmethod
     def _parse_oracle_text(text: str) -> typing.List[str]:
@@ -147,23 +282,69 @@ class Environment:
         return pat.findall(text)
 
     @staticmethod
-    def _parse_fail_to_pass(fail_to_pass: str, current_path: str) -> typing.List[str]:
+    def _parse_test_ids(fail_to_pass: typing.Union[str, typing.List[str]]) -> typing.List[str]:
+        """
+        Safely parse the list of test ids from the dataset, which is either JSON or a Python literal.
+        """
+        if isinstance(fail_to_pass, (list, tuple)):
+            return list(fail_to_pass)
+        try:
+            return json.loads(fail_to_pass)
+        except json.JSONDecodeError:
+            return ast.literal_eval(fail_to_pass)
+
+    @staticmethod
+    def _test_module_candidates(test: str) -> typing.List[str]:
+        """
+        Possible module files of a test id, most likely first. Understands pytest node ids
+        (`tests/test_a.py::TestA::test_b`) and unittest ids (`test_b (tests.test_a.TestA)`).
+        """
+        if "::" in test:
+            return [test.split("::")[0]]
+        match = re.fullmatch(r"\S+\s+\(([\w.]+)\)", test.strip())
+        dotted = match.group(1) if match else test.strip()
+        parts = dotted.split(".")
+        candidates = []
+        for end in (len(parts) - 1, len(parts), len(parts) - 2):  # module.Class, module, nested
+            if end > 0:
+                candidates.append("/".join(parts[:end]) + ".py")
+        return candidates
+
+    def _get_module_index(self, repo: str, commit: str, current_path: str) -> typing.Dict[str, str]:
+        """
+        Module index of a checkout, computed once per (repo, commit) and cached on disk.
+        """
+        if (repo, commit) not in self._module_indexes:
+            disk_cache = cache.DiskCache(namespace="module_index")
+            self._module_indexes[(repo, commit)] = disk_cache.get_or_compute(
+                disk_cache.key(repo, commit), runner_host.build_module_index, current_path
+            )
+        return self._module_indexes[(repo, commit)]
+
+    @staticmethod
+    def _parse_fail_to_pass(
+        fail_to_pass: str,
+        current_path: str,
+        module_index: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> typing.List[str]:
         """
         Parse the fail to pass string and return the list of tests that need to be fixed.
         E.g. "['test_boolean_expression_combined (expressions.tests.BasicExpressionsTests)', 'test_boolean_expression_combined_with_empty_Q (expressions.tests.BasicExpressionsTests)']"
         and current_path = "./temp/djangodjango" becomes
         ['temp/djangodjango/tests/expressions/tests.py']
         """
-        tests = set()
-        for test in eval(fail_to_pass):
-            tests.add(
-                "/".join(
-                    test.split(" ")[-1]
-                    .replace("(", "")
-                    .replace(")", "")
-                    .replace(".", "/")
-                    .split("/")[:-1]
-                )
-                + ".py"
-            )
-        return [runner_host.find_file(root_dir=current_path, filepath=test) for test in tests]
+        if module_index is None:
+            module_index = runner_host.build_module_index(current_path)
+        tests = []
+        for test in Environment._parse_test_ids(fail_to_pass):
+            candidates = Environment._test_module_candidates(test)
+            for candidate in candidates:
+                candidate = os.path.normpath(candidate).replace("\\", "/")
+                if candidate in module_index:
+                    path = module_index[candidate]
+                    break
+            else:
+                raise FileNotFoundError(f"No file found for test {test}, tried {candidates}")
+            if path not in tests:
+                tests.append(path)
+        return tests
@@ -0,0 +1,139 @@
+"""
+Persistent archive of measured fitness, so known prompts do not have to be evaluated again.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import time
+import typing
+
+from . import cache
+from . import config
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["FitnessArchive"]
+
+ArchiveKey = typing.Tuple[str, str, str]  # (prompt hash, instance id, episode config hash)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def callable_name(func: typing.Optional[typing.Callable]) -> typing.Optional[str]:
+    """
+    Name of a function that is stable across runs, e.g. `se_gym.fitness.percent_successfull`.
+    """
+    if func is None:
+        return None
+    if isinstance(func, functools.partial):
+        return f"{callable_name(func.func)}(*{func.args!r}, **{func.keywords!r})"
+    name = getattr(func, "__qualname__", None) or type(func).__qualname__
+    return f"{getattr(func, '__module__', None) or type(func).__module__}.{name}"
+
+
+class FitnessArchive:
+    """
+    Rewards of all episodes measured so far, keyed by the hash of the prompt, the id of the dataset
+    instance and the hash of everything else that determines the rewards: the sampler configuration
+    (see `sampler2.Sampler.config_hash`), the reward function, `max_steps` and `target`. Every
+    episode is one sample, so the archive holds the distribution of the fitness of a prompt, as the
+    LLM output is stochastic. A prompt is only evaluated again until it has `resamples` samples.
+
+    The archive is backed by SQLite (like `codemapretriever.SummaryStore`) and persists across
+    runs. Samples are read from the database every time, so concurrent runs (e.g. islands in other
+    processes) see each other's episodes. With `path=None` it is only kept in memory.
+    """
+
+    def __init__(
+        self,
+        path: typing.Optional[str] = "default",
+        resamples: int = config.FITNESS_ARCHIVE_RESAMPLES,
+    ):
+        if path == "default":
+            path = os.path.join(config.CACHE_DIR, "fitness.sqlite") if config.CACHE_DIR else None
+        self.path = path
+        self.resamples = resamples
+        self._memory: typing.Dict[ArchiveKey, typing.List[typing.List[float]]] = {}
+        self._database = cache.SQLiteDatabase(
+            path,
+            "CREATE TABLE IF NOT EXISTS fitness ("
+            "prompt_hash TEXT, instance_id TEXT, config_hash TEXT, rewards TEXT, created REAL)",
+            "CREATE INDEX IF NOT EXISTS fitness_key ON fitness (prompt_hash, instance_id, config_hash)",
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._database.connection()
+
+    @staticmethod
+    def key(
+        prompt: str,
+        instance_id: str,
+        sampler_hash: str,
+        reward: typing.Optional[typing.Callable] = None,
+        max_steps: int = 1,
+        target: float = 1.0,
+    ) -> ArchiveKey:
+        config_hash = cache.make_key(sampler_hash, callable_name(reward), max_steps, target)
+        return (prompt_hash(prompt), str(instance_id), config_hash)
+
+    def samples(self, key: ArchiveKey) -> typing.List[typing.List[float]]:
+        """
+        The rewards of all episodes measured for `key`, oldest first.
+        """
+        if self.path is None:
+            return self._memory.setdefault(key, [])
+        query = (
+            "SELECT rewards FROM fitness "
+            "WHERE prompt_hash = ? AND instance_id = ? AND config_hash = ? ORDER BY created"
+        )
+        rows = self._connection().execute(query, key).fetchall()
+        return [json.loads(rewards) for (rewards,) in rows]
+
+    def add(self, key: ArchiveKey, rewards: typing.List[float]):
+        rewards = [float(r) for r in rewards]
+        if self.path is None:
+            self.samples(key).append(rewards)
+        else:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT INTO fitness VALUES (?, ?, ?, ?, ?)",
+                    (*key, json.dumps(rewards), time.time()),
+                )
+
+    def is_known(self, key: ArchiveKey) -> bool:
+        """
+        Whether `key` has enough samples and does not need to be evaluated again.
+        """
+        return len(self.samples(key)) >= self.resamples
+
+    def fitness(
+        self,
+        key: ArchiveKey,
+        aggregate: typing.Callable[[typing.List[float]], float] = max,
+    ) -> typing.Optional[float]:
+        """
+        Mean fitness over all samples of `key`, each episode reduced to one value by `aggregate`.
+        None if `key` was never measured.
+        """
+        samples = self.samples(key)
+        if not samples:
+            return None
+        return statistics.fmean(aggregate(rewards) if rewards else 0 for rewards in samples)
+
+    def summary(self, key: ArchiveKey, aggregate=max) -> typing.Dict[str, float]:
+        """
+        Number of samples, mean and standard deviation of the fitness of `key`.
+        """
+        values = [aggregate(rewards) if rewards else 0 for rewards in self.samples(key)]
+        return dict(
+            n=len(values),
+            mean=statistics.fmean(values) if values else 0.0,
+            std=statistics.pstdev(values) if values else 0.0,
+        )
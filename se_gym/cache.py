@@ -0,0 +1,259 @@
+"""
+On-disk cache with one file per entry, safe to share between threads and processes.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import typing
+
+from . import config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["DiskCache", "SQLiteDatabase", "make_key"]
+
+_MISSING = object()
+
+
+def make_key(*parts) -> str:
+    """
+    Stable key of arbitrary values: the SHA-256 of their JSON representation, with sorted dict keys
+    and `repr` for values JSON does not know.
+    """
+    data = json.dumps(parts, sort_keys=True, default=repr, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """
+    Exclusive lock on `path` across processes (`fcntl` on POSIX, `msvcrt` on Windows).
+    """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            return
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:  # LK_LOCK gives up after 10 seconds
+                continue
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SQLiteDatabase:
+    """
+    One connection per thread to the SQLite database at `path`, in WAL mode, which allows
+    concurrent writers from multiple processes. The `schema` statements run on every new connection,
+    so they should be idempotent (`CREATE ... IF NOT EXISTS`).
+    """
+
+    def __init__(self, path: str, *schema: str):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+
+class DiskCache:
+    """
+    Pickled values stored in `directory/namespace/<key[:2]>/<key>.pkl`, where the key is a hash (see
+    `make_key`), so keys never collide and any value can be part of a key.
+
+    - Writes go to a temporary file that is renamed, so readers never see partial entries.
+    - `get_or_compute` holds a file lock per key, so several processes compute a missing value once.
+    - Entries older than `ttl` seconds are misses. If the namespace grows above `max_bytes`, the
+      least recently used entries are deleted.
+    - Changing `version` invalidates all entries, e.g. after changing the format of the values.
+    - Hits, misses, writes and evictions are counted in `self.metrics`.
+
+    If `directory` is empty (`config.CACHE_DIR = None`), nothing is cached.
+    """
+
+    EVICT_EVERY = 64  # writes between size checks
+
+    def __init__(
+        self,
+        namespace: str = "default",
+        directory: typing.Optional[str] = "default",
+        max_bytes: typing.Optional[int] = config.CACHE_MAX_BYTES,
+        ttl: typing.Optional[float] = config.CACHE_TTL_SECONDS,
+        version: str = config.CACHE_VERSION,
+    ):
+        if directory == "default":
+            directory = config.CACHE_DIR
+        self.path = os.path.join(directory, namespace) if directory else None
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = version
+        self.metrics = dict(hits=0, misses=0, writes=0, evictions=0)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def key(self, *parts) -> str:
+        return make_key(self.version, *parts)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.pkl")
+
+    def _count(self, metric: str):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def _load(self, key: str):
+        file = self._file(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(file) > self.ttl:
+                self._delete(file)
+                return _MISSING
+            with open(file, "rb") as f:
+                value = pickle.load(f)
+            os.utime(file, (time.time(), os.path.getmtime(file)))  # access time for eviction
+            return value
+        except FileNotFoundError:
+            return _MISSING
+        except Exception:
+            logger.warning(f"Corrupt cache entry {file}, deleting it", exc_info=True)
+            self._delete(file)
+            return _MISSING
+
+    def get(self, key: str, default=None):
+        """
+        The cached value of `key` (from `self.key`), or `default`.
+        """
+        if not self.enabled:
+            return default
+        value = self._load(key)
+        self._count("misses" if value is _MISSING else "hits")
+        return default if value is _MISSING else value
+
+    def set(self, key: str, value):
+        if not self.enabled:
+            return
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        fd, temp = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(file))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, file)
+        except BaseException:
+            self._delete(temp)
+            raise
+        self._count("writes")
+        with self._lock:
+            self._writes += 1
+            evict = self.max_bytes is not None and self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def get_or_compute(self, key: str, func: typing.Callable, *args, **kwargs):
+        """
+        The cached value of `key`, or the result of `func(*args, **kwargs)`, which is then cached.
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+        value = self._load(key)
+        if value is _MISSING:
+            lock = self._file(key) + ".lock"
+            os.makedirs(os.path.dirname(lock), exist_ok=True)
+            with _file_lock(lock):
+                value = self._load(key)  # another process may have computed it meanwhile
+                if value is _MISSING:
+                    self._count("misses")
+                    value = func(*args, **kwargs)
+                    self.set(key, value)
+                    return value
+        self._count("hits")
+        return value
+
+    def _entries(self) -> typing.List[typing.Tuple[str, os.stat_result]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for name in filenames:
+                if name.endswith(".pkl"):
+                    file = os.path.join(dirpath, name)
+                    try:
+                        entries.append((file, os.stat(file)))
+                    except FileNotFoundError:
+                        pass
+        return entries
+
+    @staticmethod
+    def _delete(file: str):
+        try:
+            os.remove(file)
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Delete expired entries, then the least recently used entries until the namespace is smaller
+        than `max_bytes`.
+        """
+        if not self.enabled or not os.path.isdir(self.path):
+            return
+        now = time.time()
+        entries = []
+        for file, stat in self._entries():
+            if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                self._delete(file)
+                self._count("evictions")
+                self._delete(file + ".lock")
+            else:
+                entries.append((file, stat))
+        if self.max_bytes is None:
+            return
+        size = sum(stat.st_size for _, stat in entries)
+        for file, stat in sorted(entries, key=lambda e: e[1].st_atime):
+            if size <= self.max_bytes:
+                break
+            self._delete(file)
+            self._delete(file + ".lock")
+            size -= stat.st_size
+            self._count("evictions")
+
+    def clear(self):
+        if not self.enabled or not os.path.isdir(self.path):
+            return
+        for file, _ in self._entries():
+            self._delete(file)
+            self._delete(file + ".lock")
@@ -0,0 +1,172 @@
+"""
+Checkpoint and resume long evolution runs.
+"""
+
+import dataclasses
+import logging
+import os
+import pickle
+import random
+import tempfile
+import typing
+
+import numpy as np
+
+from . import api
+
+if typing.TYPE_CHECKING:
+    from . import genetic  # only for annotations, genetic imports haystack and openai
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Checkpoint", "run_evolution"]
+
+
+@dataclasses.dataclass
+class Checkpoint:
+    """
+    Snapshot of an evolution run. Written after every generation (and optionally after every
+    episode), so a run can be resumed without re-running finished episodes.
+    """
+
+    generation: int = 0
+    individuals: typing.List[str] = dataclasses.field(default_factory=list)
+    history: typing.List[typing.Dict[str, typing.Any]] = dataclasses.field(default_factory=list)
+    issue: typing.Optional[int] = None  # issue of the current generation, None if not chosen yet
+    completed: typing.List[typing.Tuple[str, typing.List[float]]] = dataclasses.field(
+        default_factory=list
+    )  # finished episodes of the current generation
+    random_state: typing.Optional[tuple] = None  # state of `random` at the start of the generation
+    numpy_random_state: typing.Optional[tuple] = None
+
+    @classmethod
+    def capture(cls, population: "genetic.Population", **kwargs) -> "Checkpoint":
+        """
+        Create a checkpoint of the population and the current random state.
+        """
+        return cls(
+            individuals=list(population.individuals),
+            random_state=random.getstate(),
+            numpy_random_state=np.random.get_state(),
+            **kwargs,
+        )
+
+    def restore(self, population: "genetic.Population"):
+        """
+        Restore the individuals of the population and the random state.
+        """
+        population.individuals = list(self.individuals)
+        if self.random_state is not None:
+            random.setstate(self.random_state)
+        if self.numpy_random_state is not None:
+            np.random.set_state(self.numpy_random_state)
+
+    def save(self, path: str):
+        """
+        Write the checkpoint atomically: a crash while writing leaves the previous checkpoint intact.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(prefix=".checkpoint_", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "Checkpoint":
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if not isinstance(checkpoint, cls):
+            raise ValueError(f"{path} is not a checkpoint")
+        return checkpoint
+
+
+def run_evolution(
+    population: "genetic.Population",
+    env: api.Environment,
+    reward: typing.Callable[[api.State], float],
+    num_generations: int,
+    path: str,
+    issues: typing.Optional[typing.List[int]] = None,
+    max_steps: int = 1,
+    target: float = 1.0,
+    aggregate: typing.Callable[[typing.List[float]], float] = max,
+    save_every_episode: bool = False,
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Evaluate and evolve the population for `num_generations` generations, checkpointing to `path`.
+    If `path` exists, the run is resumed from it: finished generations and finished episodes of
+    the current generation are not run again.
+
+    Args:
+        population (genetic.Population): The population, replaced by the checkpointed one on resume.
+        env (api.Environment): The environment.
+        reward (Callable): Reward of a state, e.g. `fitness.percent_successfull`.
+        num_generations (int): Total number of generations, including already finished ones.
+        path (str): The checkpoint file.
+        issues (List[int], optional): Generation `g` uses issue `issues[g % len(issues)]`. A random
+            issue per generation if not given.
+        max_steps (int): Maximum number of steps per episode.
+        target (float): An episode ends early once its reward reaches `target`.
+        aggregate (Callable): Reduces the rewards of an episode to its fitness.
+        save_every_episode (bool): Also checkpoint after every finished episode.
+
+    Returns:
+        List[dict]: The history: issue, individuals, rewards and fitnesses of every generation.
+    """
+    if os.path.exists(path):
+        checkpoint = Checkpoint.load(path)
+        checkpoint.restore(population)
+        logger.info(
+            f"Resuming from {path} at generation {checkpoint.generation} "
+            f"({len(checkpoint.completed)} episodes finished)"
+        )
+    else:
+        checkpoint = Checkpoint.capture(population)
+
+    while checkpoint.generation < num_generations:
+        if checkpoint.issue is None:
+            if issues:
+                checkpoint.issue = issues[checkpoint.generation % len(issues)]
+            else:
+                checkpoint.issue = random.randint(0, env.num_challenges - 1)
+            checkpoint.random_state = random.getstate()
+            checkpoint.save(path)
+
+        def on_episode(individual, rewards):
+            checkpoint.completed.append((individual, list(rewards)))
+            if save_every_episode:
+                checkpoint.save(path)
+
+        rewards = population.evaluate(
+            env,
+            reward,
+            issue=checkpoint.issue,
+            max_steps=max_steps,
+            target=target,
+            completed=checkpoint.completed,
+            on_episode=on_episode,
+        )
+        fitnesses = population.fitnesses(env, rewards, reward, max_steps, target, aggregate)
+        checkpoint.history.append(
+            dict(
+                generation=checkpoint.generation,
+                issue=checkpoint.issue,
+                individuals=list(population.individuals),
+                rewards=rewards,
+                fitnesses=fitnesses,
+            )
+        )
+        population.evolve(fitnesses)
+        checkpoint = Checkpoint.capture(
+            population, generation=checkpoint.generation + 1, history=checkpoint.history
+        )
+        checkpoint.save(path)
+        logger.info(f"Generation {checkpoint.generation - 1} done, checkpoint saved to {path}")
+    return checkpoint.history
@@ -2,14 +2,22 @@ from haystack.components.builders import PromptBuilder
 from haystack.document_stores.in_memory import InMemoryDocumentStore
 import haystack
 import copy
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+import time
 import typing
 import logging
 import ast
 import re
 import pydantic
+import rank_bm25
+from . import cache
 from . import config
 from . import generators
-from . import utils
+from . import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +64,66 @@ class FileSelectionValidator:
             return {"invalid_replies": replies, "error_message": str(e)}
 
 
+SummaryKey = typing.Tuple[str, str, str]  # (content hash, model name, prompt template hash)
+
+
+class SummaryStore:
+    """
+    Persistent store of LLM summaries, one record per file or directory content hash, model and
+    prompt template hash. The store is shared across commits and repositories, as only the content
+    matters. It is backed by SQLite, which allows concurrent writers from multiple processes.
+    """
+
+    def __init__(self, path: typing.Optional[str] = "default"):
+        if path == "default":
+            path = os.path.join(config.CACHE_DIR, "summaries.sqlite") if config.CACHE_DIR else None
+        self.path = path
+        self._memory: typing.Dict[SummaryKey, str] = {}
+        self._database = cache.SQLiteDatabase(
+            path,
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "content_hash TEXT, model TEXT, template_hash TEXT, path TEXT, summary TEXT, "
+            "created REAL, PRIMARY KEY (content_hash, model, template_hash))",
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._database.connection()
+
+    def get(self, key: SummaryKey) -> typing.Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: typing.List[SummaryKey]) -> typing.Dict[SummaryKey, str]:
+        """
+        Load the summaries of the given keys. Keys without a summary are missing in the result.
+        """
+        found = {k: self._memory[k] for k in keys if k in self._memory}
+        missing = [k for k in keys if k not in found]
+        if self.path is not None and missing:
+            conn = self._connection()
+            wanted = set(missing)
+            for i in range(0, len(missing), 500):  # stay below the SQLite variable limit
+                hashes = [k[0] for k in missing[i : i + 500]]
+                rows = conn.execute(
+                    "SELECT content_hash, model, template_hash, summary FROM summaries "
+                    f"WHERE content_hash IN ({', '.join('?' * len(hashes))})",
+                    hashes,
+                ).fetchall()
+                for content_hash, model, template_hash, summary in rows:
+                    if (content_hash, model, template_hash) in wanted:
+                        found[(content_hash, model, template_hash)] = summary
+            self._memory.update(found)
+        return found
+
+    def put(self, key: SummaryKey, summary: str, path: str = ""):
+        self._memory[key] = summary
+        if self.path is not None:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?)",
+                    (*key, path, summary, time.time()),
+                )
+
+
 @haystack.component
 class CodeMapRetriever:
     template_select = """
@@ -65,7 +133,7 @@ You are a world-class software engineer. You have been tasked to collect files f
 
 The following files are in the current repository: 
 
-{% for child in node.meta.children %}
+{% for child in children %}
 - {{child.meta.file_path_relative}}: Summary: {{child.meta.llm_summary}}
 {% endfor %}
 
@@ -116,36 +184,64 @@ The directory contains the following directories and files:
 {% endfor %}
 """
 
+    OTHER = "[other]"  # name of the directory grouping the children removed by the pre-filter
+
     prompt_builder_file = PromptBuilder(template=template_sumfile)
     prompt_builder_dir = PromptBuilder(template=template_sumdir)
 
-    def __init__(self, document_store: InMemoryDocumentStore):
+    def __init__(
+        self,
+        document_store: InMemoryDocumentStore,  # needs a path index, see `observe.IndexedDocumentStore`
+        beam_width: typing.Optional[int] = config.CODEMAP_BEAM_WIDTH,
+        max_depth: int = config.CODEMAP_MAX_DEPTH,
+        token_budget: typing.Optional[int] = config.CODEMAP_TOKEN_BUDGET,
+        prefilter_top_n: typing.Optional[int] = config.CODEMAP_PREFILTER_TOP_N,
+    ):
         self.document_store = document_store
         self.llm = generators.CustomGenerator(
             model_config=config.RETRIEVER_MODEL_CONFIG, no_verify=True
         )
-        self.validator = FileSelectionValidator()
-        self.pipeline = haystack.Pipeline(max_loops_allowed=3)
-        self.prompt_builder_select = PromptBuilder(template=self.template_select)
-        self.pipeline.add_component(instance=self.prompt_builder_select, name="prompt_builder")
-        self.pipeline.add_component(instance=self.validator, name="validator")
-        self.pipeline.add_component(instance=self.llm, name="llm")
-        self.pipeline.connect("prompt_builder", "llm")
-        self.pipeline.connect("llm", "validator")
-        self.pipeline.connect("validator.invalid_replies", "prompt_builder.invalid_replies")
-        self.pipeline.connect("validator.error_message", "prompt_builder.error_message")
+        self.beam_width = beam_width
+        self.max_depth = max_depth
+        self.token_budget = token_budget
+        self.prefilter_top_n = prefilter_top_n
+        self._bm25 = {}
+        self._local = threading.local()
+        self._schemas = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=beam_width or config.SUMMARY_CONCURRENCY
+        )
+        self.timings = []
         self.absolute_path = None
         self._codemap_root = None
+        self.summary_store = SummaryStore()
 
     @staticmethod
-    def _summ_files(files: typing.List[haystack.Document], llm):
-        """
-        Add a summary to each file in the list of files.
-        """
-        logger.debug(f"Summarizing {len(files)} files")
-        for f in files:
-            f.meta["llm_summary"] = CodeMapRetriever._summ_file(f, llm)
-        return files
+    def _hash(*parts: str) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part.encode("utf-8", "surrogatepass"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @staticmethod
+    def _file_key(d: haystack.Document, model_name: str) -> SummaryKey:
+        return (
+            CodeMapRetriever._hash(d.meta["file_path_relative"], d.content or ""),
+            model_name,
+            CodeMapRetriever._hash(CodeMapRetriever.template_sumfile),
+        )
+
+    @staticmethod
+    def _dir_key(d: _DocumentDirectory, model_name: str) -> SummaryKey:
+        children = [
+            f"{c.meta['file_path_relative']}: {c.meta['llm_summary']}" for c in d.meta["children"]
+        ]
+        return (
+            CodeMapRetriever._hash(d.meta["file_path_relative"], *children),
+            model_name,
+            CodeMapRetriever._hash(CodeMapRetriever.template_sumdir),
+        )
 
     @staticmethod
     def _summ_file(d: haystack.Document, llm) -> str:
@@ -174,128 +270,320 @@ The directory contains the following directories and files:
         docs: typing.List[haystack.Document],
     ) -> typing.Dict[str, typing.List[typing.Union[str, haystack.Document]]]:
         """
-        Construct a tree of directories and files from a list of documents.
+        Construct a tree of directories and files from a list of documents. Maps every directory
+        (including directories that only contain other directories) to its direct children, which
+        are either documents or the paths of subdirectories. The first key is the root directory.
         """
-        intermediate_dirs = {}
+        tree = {}
         for doc in docs:
             path = doc.meta["file_path_relative"]
-            path_without_filename = "/".join(path.split("/")[:-1])
-            if path_without_filename not in intermediate_dirs:
-                intermediate_dirs[path_without_filename] = []
-            intermediate_dirs[path_without_filename].append(doc)
-        updated_dirs = intermediate_dirs.copy()
-        for dir_path in intermediate_dirs.keys():  # add directories that are not in the list, e.g. if a directory contains only other directories
-            parts = dir_path.split("/")
-            for i in range(1, len(parts)):
-                parent_dir = "/".join(parts[:i])
-                if parent_dir in updated_dirs:
-                    updated_dirs[parent_dir].append(dir_path)
-        return updated_dirs
+            parts = path.split("/")[:-1]
+            tree.setdefault("/".join(parts), []).append(doc)
+            for i in range(len(parts), 0, -1):  # register the directory in all of its ancestors
+                dir_path, parent_dir = "/".join(parts[:i]), "/".join(parts[: i - 1])
+                siblings = tree.setdefault(parent_dir, [])
+                if dir_path in siblings:
+                    break
+                siblings.append(dir_path)
+        root = ""
+        while len(tree.get(root, [])) == 1 and isinstance(tree[root][0], str):
+            root = tree.pop(root)[0]  # skip directories that only contain a single directory
+        return {root: tree.get(root, []), **{k: v for k, v in tree.items() if k != root}}
 
     @staticmethod
-    def _summ_create_dir_entry(
+    def _summ_tree(
         all_intermediate_dirs: typing.Dict[str, typing.List[typing.Union[str, haystack.Document]]],
         llm,
-        current: typing.Optional[str] = None,
-        new_docs: typing.Optional[typing.List[_DocumentDirectory]] = None,
-    ) -> typing.Tuple[_DocumentDirectoryRoot, typing.List[_DocumentDirectory]]:
-        if current is None:
-            current = list(all_intermediate_dirs.keys())[0]
-        if new_docs is None:
-            new_docs = []
-        children = all_intermediate_dirs.get(current, [])
-        clean_children = []
-        for c in children:
-            if isinstance(c, str):
-                clean_children.append(
-                    CodeMapRetriever._summ_create_dir_entry(
-                        all_intermediate_dirs, llm=llm, current=c, new_docs=new_docs
-                    )[0]
+        summary_store: typing.Optional[SummaryStore] = None,
+        max_workers: int = config.SUMMARY_CONCURRENCY,
+    ) -> typing.List[_DocumentDirectory]:
+        """
+        Summarize all files and directories of the tree as a dependency ordered DAG: all files are
+        summarized concurrently, each directory as soon as all of its children are summarized.
+        Summaries are cached by content hash in `summary_store`, so only changed files and their
+        ancestors are sent to the LLM. Returns the new directory documents, the root directory is the
+        last one.
+        """
+        model_name = getattr(llm, "model_name", "unknown")
+        if summary_store is None:
+            summary_store = SummaryStore(path=None)
+        root = next(iter(all_intermediate_dirs))
+        dirs = {
+            p: _DocumentDirectory(content=None, meta={"file_path_relative": p, "children": []})
+            for p in all_intermediate_dirs
+        }
+        parents = {}
+        for path, children in all_intermediate_dirs.items():
+            for c in children:
+                child = dirs[c] if isinstance(c, str) else c
+                dirs[path].meta["children"].append(child)
+                parents[id(child)] = dirs[path]
+        remaining = {path: len(d.meta["children"]) for path, d in dirs.items()}
+        new_docs = []
+        num_llm_calls = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+
+            def schedule(node: haystack.Document):
+                nonlocal num_llm_calls
+                if isinstance(node, _DocumentDirectory):
+                    key = CodeMapRetriever._dir_key(node, model_name)
+                    summarize = CodeMapRetriever._summ_dir
+                else:
+                    key = CodeMapRetriever._file_key(node, model_name)
+                    summarize = CodeMapRetriever._summ_file
+                summary = known.get(key) or summary_store.get(key)
+                if summary is not None:
+                    complete(node, summary)
+                else:
+                    num_llm_calls += 1
+                    pending[executor.submit(tracing.propagate(summarize), node, llm)] = (node, key)
+
+            def complete(node: haystack.Document, summary: str):
+                node.meta["llm_summary"] = summary
+                if isinstance(node, _DocumentDirectory):
+                    new_docs.append(node)
+                parent = parents.get(id(node))
+                if parent is not None:
+                    remaining[parent.meta["file_path_relative"]] -= 1
+                    if remaining[parent.meta["file_path_relative"]] == 0:
+                        schedule(parent)
+
+            leaves = [d for d in dirs.values() if not d.meta["children"]]  # empty directories
+            for d in dirs.values():
+                leaves += [c for c in d.meta["children"] if not isinstance(c, _DocumentDirectory)]
+            known = summary_store.get_many(
+                [
+                    CodeMapRetriever._file_key(leaf, model_name)
+                    for leaf in leaves
+                    if not isinstance(leaf, _DocumentDirectory)
+                ]
+            )  # one query for all files
+            for leaf in leaves:
+                schedule(leaf)
+            while pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
                 )
-            else:
-                clean_children.append(c)
+                for future in done:
+                    node, key = pending.pop(future)
+                    summary = future.result()
+                    summary_store.put(key, summary, path=node.meta["file_path_relative"])
+                    complete(node, summary)
 
-        new_dir = _DocumentDirectory(
-            content=None, meta={"children": clean_children, "file_path_relative": current}
-        )
-        summary = CodeMapRetriever._summ_dir(new_dir, llm)
-        new_dir.meta["llm_summary"] = summary
-        new_docs.append(new_dir)
-        return new_dir, new_docs
+        logger.debug(f"Summarized {len(dirs)} directories with {num_llm_calls} LLM calls")
+        new_docs.remove(dirs[root])
+        return new_docs + [dirs[root]]
 
     def _summ_get_new_dir_docs(self, documents: typing.List[haystack.Document]):
-        documents = CodeMapRetriever._summ_files(documents, llm=self.llm)
         all_intermediate_dirs = CodeMapRetriever._summ_include_subdirectories(documents)
-        new_docs = self._summ_create_dir_entry(all_intermediate_dirs, llm=self.llm)[1]
+        new_docs = CodeMapRetriever._summ_tree(
+            all_intermediate_dirs, llm=self.llm, summary_store=self.summary_store
+        )
         return documents + new_docs
 
-    def get_summed_docs(self, documents: typing.List[haystack.Document], state=None):
+    def get_summed_docs(self, documents: typing.List[haystack.Document]):
         """
         Create a code map from a list of documents and return a new list of documents with summaries.
         """
         documents = copy.deepcopy(documents)
-        if state is not None:
-            new_docs = utils.cache(
-                f"{state.repo}_{state.setup_commit}_{self.llm.model_name}_docs",
-                self._summ_get_new_dir_docs,
-                documents,
-            )
-        else:
-            new_docs = self._summ_get_new_dir_docs(documents)
+        new_docs = self._summ_get_new_dir_docs(documents)
         self._codemap_root = new_docs[-1]
+        self._bm25 = {}
         return new_docs
 
-    def _select_recursive(self, node: haystack.Document, query: str) -> typing.List[str]:
-        if not isinstance(node, _DocumentDirectory):
-            return [node.meta["file_path_relative"]]  # file has been selected
-        else:
-            try:
-                self.validator.all_paths = [
-                    c.meta["file_path_relative"] for c in node.meta["children"]
-                ]
+    def _get_select_pipeline(self) -> typing.Tuple[haystack.Pipeline, FileSelectionValidator]:
+        """
+        Selection pipelines are stateful (the validator needs the selectable paths), so every thread
+        gets its own pipeline with its own generator, as a component can only be in one pipeline.
+        """
+        if not hasattr(self._local, "pipeline"):
+            validator = FileSelectionValidator()
+            pipeline = haystack.Pipeline(max_loops_allowed=3)
+            pipeline.add_component(
+                instance=PromptBuilder(template=self.template_select), name="prompt_builder"
+            )
+            pipeline.add_component(instance=validator, name="validator")
+            llm = generators.CustomGenerator(
+                model_config=config.RETRIEVER_MODEL_CONFIG, no_verify=True
+            )
+            pipeline.add_component(instance=llm, name="llm")
+            pipeline.connect("prompt_builder", "llm")
+            pipeline.connect("llm", "validator")
+            pipeline.connect("validator.invalid_replies", "prompt_builder.invalid_replies")
+            pipeline.connect("validator.error_message", "prompt_builder.error_message")
+            self._local.pipeline, self._local.validator = pipeline, validator
+        return self._local.pipeline, self._local.validator
+
+    def _get_schema(self, all_paths: typing.List[str]) -> typing.Type[pydantic.BaseModel]:
+        """
+        The response schema only allows the children of the directory, it is created once per
+        directory.
+        """
+        key = tuple(all_paths)
+        if key not in self._schemas:
+            all_files = tuple([typing.Literal[f] for f in all_paths])  # type: ignore
 
-                all_files = tuple([typing.Literal[f] for f in self.validator.all_paths])  # type: ignore
-
-                class SelectableFiles(pydantic.BaseModel):
-                    files: typing.Set[typing.Union[all_files]]  # type: ignore
-
-                pipeline_res = self.pipeline.run(
-                    data={
-                        "prompt_builder": {
-                            "node": node,
-                            "issue": query,
-                            "all_paths": self.validator.all_paths,
-                        },
-                        "llm": {
-                            "schema": SelectableFiles,
-                        },
-                    }
-                )
-                res = pipeline_res["validator"]["valid_replies"][0]
-                logger.debug(
-                    f"Dir `{node.meta['file_path_relative']}` possible selections: {self.validator.all_paths} selected: {res}"
+            class SelectableFiles(pydantic.BaseModel):
+                files: typing.Set[typing.Union[all_files]]  # type: ignore
+
+            self._schemas[key] = SelectableFiles
+        return self._schemas[key]
+
+    @staticmethod
+    def _tokenize(text: str) -> typing.List[str]:
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+    def _prefilter(self, node: _DocumentDirectory, query: str) -> typing.List[haystack.Document]:
+        """
+        Rank the children of a directory against the query with BM25 over their path and summary.
+        Only the `prefilter_top_n` best children are shown to the LLM, the remaining children are
+        grouped into a single "other" directory, which can be selected to look at them in the next
+        level.
+        """
+        children = node.meta["children"]
+        if self.prefilter_top_n is None or len(children) <= self.prefilter_top_n + 1:
+            return children
+        path = node.meta["file_path_relative"]
+        key = tuple(c.meta["file_path_relative"] for c in children)
+        bm25 = self._bm25.get(key)
+        if bm25 is None:
+            corpus = [
+                f"{c.meta['file_path_relative']} {c.meta.get('llm_summary', '')}" for c in children
+            ]
+            bm25 = rank_bm25.BM25Okapi([self._tokenize(text) for text in corpus])
+            if not path.endswith(self.OTHER):  # its children differ per query, do not cache
+                self._bm25[key] = bm25
+        scores = bm25.get_scores(self._tokenize(query))
+        order = sorted(range(len(children)), key=lambda i: scores[i], reverse=True)
+        shown = [children[i] for i in sorted(order[: self.prefilter_top_n])]
+        others = [children[i] for i in sorted(order[self.prefilter_top_n :])]
+        names = ", ".join(c.meta["file_path_relative"].split("/")[-1] for c in others)
+        other = _DocumentDirectory(
+            content=None,
+            meta={
+                "file_path_relative": f"{path}/{self.OTHER}" if path else self.OTHER,
+                "children": others,
+                "llm_summary": f"{len(others)} further entries that look less relevant: {names}",
+            },
+        )
+        return shown + [other]
+
+    def prefilter_recall(self, query: str, oracle_files: typing.List[str]) -> typing.Dict:
+        """
+        Measure how many of the oracle files (e.g. from `Environment._parse_oracle_text`) survive the
+        pre-filter, i.e. can be reached without selecting an "other" directory. Also reports how
+        many children are shown to the LLM compared to the unfiltered code map.
+        """
+        assert self._codemap_root is not None, "Have you called store.update()?"
+        reachable, num_shown, num_total = set(), 0, 0
+        stack = [self._codemap_root]
+        while stack:
+            node = stack.pop()
+            shown = self._prefilter(node, query)
+            num_shown += len(shown)
+            num_total += len(node.meta["children"])
+            for child in shown:
+                if isinstance(child, _DocumentDirectory):
+                    if not child.meta["file_path_relative"].endswith(self.OTHER):
+                        stack.append(child)
+                else:
+                    reachable.add(child.meta["file_path_relative"])
+        found = [f for f in oracle_files if any(r == f or r.endswith("/" + f) for r in reachable)]
+        return dict(
+            recall=len(found) / len(oracle_files) if oracle_files else 1.0,
+            missed=[f for f in oracle_files if f not in found],
+            shown_children=num_shown,
+            total_children=num_total,
+        )
+
+    def _select_children(
+        self, node: _DocumentDirectory, query: str
+    ) -> typing.Tuple[typing.List[haystack.Document], int]:
+        """
+        Let the LLM select the most relevant children of a directory. Returns the selected children
+        sorted by importance and the number of tokens used.
+        """
+        # outside of the try block: failing to build the pipeline is a bug, not an empty selection
+        pipeline, validator = self._get_select_pipeline()
+        try:
+            candidates = self._prefilter(node, query)
+            validator.all_paths = [c.meta["file_path_relative"] for c in candidates]
+            pipeline_res = pipeline.run(
+                data={
+                    "prompt_builder": {
+                        "children": candidates,
+                        "issue": query,
+                        "all_paths": validator.all_paths,
+                    },
+                    "llm": {
+                        "schema": self._get_schema(validator.all_paths),
+                    },
+                }
+            )
+            res = pipeline_res["validator"]["valid_replies"][0]
+            logger.debug(
+                f"Dir `{node.meta['file_path_relative']}` possible selections: {validator.all_paths} selected: {res}"
+            )
+            usage = pipeline_res.get("llm", {}).get("meta", [{}])[0]
+            children = {c.meta["file_path_relative"]: c for c in candidates}
+            selected = [children[r] for r in dict.fromkeys(res) if r in children]
+            return selected, usage.get("total_tokens", 0)
+        except Exception as e:
+            logger.debug(f"Error in selecting files: {e}")
+            return [], 0
+
+    def _select_beam(self, root: _DocumentDirectory, query: str) -> typing.List[str]:
+        """
+        Select files by descending the code map level by level. All directories of a level are
+        handled concurrently and at most `beam_width` directories (all if None) are kept per level,
+        preferring the ones ranked highest by their parent. The descent stops at `max_depth` or once
+        `token_budget` tokens have been used. Latency per level is stored in `self.timings`.
+        """
+        selected_files = []
+        frontier = [root]
+        tokens = 0
+        self.timings = []
+        for depth in range(self.max_depth):
+            if not frontier:
+                break
+            if self.token_budget is not None and tokens >= self.token_budget:
+                logger.debug(f"Token budget of {self.token_budget} exhausted at depth {depth}")
+                break
+            start = time.perf_counter()
+            select = tracing.propagate(lambda n: self._select_children(n, query))
+            results = list(self._executor.map(select, frontier))
+            tokens += sum(r[1] for r in results)
+            files, dirs = [], []  # children of all directories by rank, interleaved between parents
+            for rank in range(max((len(r[0]) for r in results), default=0)):
+                for children, _ in results:
+                    if rank < len(children):
+                        child = children[rank]
+                        (dirs if isinstance(child, _DocumentDirectory) else files).append(child)
+            selected_files += [f.meta["file_path_relative"] for f in files]
+            self.timings.append(
+                dict(
+                    depth=depth,
+                    num_dirs=len(frontier),
+                    num_selected=len(files) + len(dirs),
+                    seconds=time.perf_counter() - start,
                 )
-                for child in node.meta["children"]:
-                    if child.meta["file_path_relative"] in res:
-                        res += self._select_recursive(child, query)
-                return res
-            except Exception as e:
-                logger.debug(f"Error in selecting files: {e}")
-                return []
+            )
+            frontier = dirs if self.beam_width is None else dirs[: self.beam_width]
+        logger.debug(f"Code map selection timings: {self.timings}, {tokens} tokens")
+        return selected_files
 
     @haystack.component.output_types(documents=typing.List[haystack.Document])
     def run(self, query: str):
         assert (
             self._codemap_root is not None
         ), "set_code_map has to be called before running. Have you called store.update()?"
-        selected_files = self._select_recursive(self._codemap_root, query)
-        selected_files = list(set(selected_files))
+        selected_files = self._select_beam(self._codemap_root, query)
         logger.debug(f"Selected files: {selected_files}")
-        documents = []
-        for doc in self.document_store.filter_documents():
-            fpr = doc.meta["file_path_relative"].replace("\\", "/")
-            if fpr in selected_files:
-                if not isinstance(doc, _DocumentDirectory):
-                    documents.append(doc)
-                selected_files.remove(fpr)
+        documents = [
+            doc
+            for doc in self.document_store.get_documents_by_path(selected_files)
+            if not isinstance(doc, _DocumentDirectory)
+        ]
         return {"documents": documents}
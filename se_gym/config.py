@@ -3,8 +3,14 @@ RAG_TOP_N = 4
 TIMEOUT_SECONDS = 60
 DEFAULT_SAVE_PATH = "./temp"
 DOCKER_TAG = "pytest-env"
+RUNNER = "docker"  # runs the tests in api.Environment, "docker" or "local" (runner_local)
+LOCAL_VENV_MODE = "link"  # per job copy of the shared venv: "link", "copy" or "shared"
+LOCAL_SYSTEM_SITE_PACKAGES = True  # local venvs also see the packages of this interpreter
+LOCAL_MEMORY_LIMIT_BYTES = 8 * 1024**3  # address space of local test runs, None for no limit
+LOCAL_CPU_LIMIT_SECONDS = None  # CPU time of local test runs, None for no limit
 GIT_DISCARD_CHANGES = "git reset --hard HEAD"
 GIT_DIFF = "git diff"
+GIT_URL_TEMPLATE = "https://github.com/{repo}.git"  # e.g. a local mirror "/mirrors/{repo}.git"
 MODEL_CONFIG = dict(
     base_url="https://api.openai.com/v1/", api_key="YOUR_KEY_HERE", model_name="gpt-4o-mini"
 )
@@ -17,5 +23,35 @@ RETRIEVER_MODEL_CONFIG = dict(
 LLM_TIMEOUT = 60
 LLM_NUM_TIMEOUTS = 1
 CACHE_DIR = "./.cache"
+CACHE_MAX_BYTES = 2 * 1024**3  # per namespace of cache.DiskCache, evicting least recently used
+CACHE_TTL_SECONDS = None  # entries of cache.DiskCache older than this are recomputed, None to keep
+CACHE_VERSION = "1"  # change to invalidate all entries of cache.DiskCache
 FUZZY_MATCH_THRESHOLD = 80
 LLAMACPP_COMPATIBLE_SCHEMA = False
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DEVICE = "cpu"
+EMBEDDING_OFFLINE = True  # only load the embedding model from the local cache, never download
+EMBEDDING_CACHE_SIZE = 100000  # embeddings kept in memory by LocalEmbedder, least recently used
+HYBRID_JOIN_MODE = "reciprocal_rank_fusion"  # or "weighted"
+HYBRID_WEIGHTS = dict(bm25=0.5, embedding=0.5)
+EMBEDDING_INDEX_DTYPE = "float32"  # "float16" or "int8" to quantize the embedding index
+SUMMARY_CONCURRENCY = 8  # number of concurrent LLM calls when building a code map
+CODEMAP_BEAM_WIDTH = None  # maximum directories explored per code map level, None for all
+CODEMAP_MAX_DEPTH = 10
+CODEMAP_TOKEN_BUDGET = None  # maximum number of LLM tokens used per code map selection
+CODEMAP_PREFILTER_TOP_N = None  # only show the N children most similar to the issue (BM25)
+TOKENIZER_ENCODING = "cl100k_base"  # tiktoken encoding used to count prompt tokens, if available
+PROMPT_TOKEN_BUDGET = 12000  # tokens available for documents and logs in the sampler prompt
+PROMPT_LOG_FRACTION = 0.3  # share of the prompt budget that logs may use
+LOG_MESSAGE_TAIL_TOKENS = 200  # tokens kept from the end of each failure message
+LOG_MESSAGE_MAX_CHARS = 4000  # characters kept from the end of each failure message in State.logs
+DATASET_ROW_CACHE_SIZE = 16  # number of dataset rows kept in memory by the environment
+FITNESS_WEIGHTS = dict(pass_rate=1.0)  # weights of the metrics in fitness.batch_fitness
+TEST_WORKERS = 4  # number of actions tested concurrently (docker containers) by genetic.Population
+EVO_CONCURRENCY = 4  # number of concurrent mutation and crossover requests in genetic.Population
+ISLAND_MIGRATION_INTERVAL = 1  # generations between migrations in islands.IslandModel
+ISLAND_NUM_MIGRANTS = 1  # best individuals sent to the next island on every migration
+ISLAND_MIGRATION_TIMEOUT_SECONDS = 3600  # max wait of an island for its immigrants
+FITNESS_ARCHIVE_RESAMPLES = 1  # episodes of a prompt per instance before its fitness is reused
+EXPERIMENT_LOG_FLUSH_ROWS = 256  # buffered rows that trigger a write of the experiment log
+EXPERIMENT_LOG_FLUSH_SECONDS = 5.0  # maximum seconds rows stay buffered in the experiment log
@@ -0,0 +1,255 @@
+"""
+Local (offline, CPU) embeddings for the `embedding` and `hybrid` retrievers of `observe.Store`.
+"""
+
+import collections
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+
+import haystack
+import numpy as np
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["LocalEmbedder", "EmbeddingIndex", "EmbeddingRetriever"]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class LocalEmbedder:
+    """
+    Wraps a small sentence-transformers model running on the CPU. Embeddings are cached by the hash of
+    the embedded text, so re-indexing a repository after a patch only embeds the changed chunks. The
+    cache keeps the `config.EMBEDDING_CACHE_SIZE` most recently used embeddings.
+    """
+
+    def __init__(
+        self,
+        model_name: typing.Optional[str] = None,
+        device: typing.Optional[str] = None,
+        batch_size: int = 32,
+    ):
+        self.model_name = model_name or config.EMBEDDING_MODEL
+        self.device = device or config.EMBEDDING_DEVICE
+        self.batch_size = batch_size
+        self._model = None
+        self._cache: typing.OrderedDict[str, np.ndarray] = collections.OrderedDict()
+
+    @property
+    def model(self):
+        if self._model is None:
+            try:
+                # delayed import to avoid slow startup
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError(
+                    "The embedding retrievers require `sentence-transformers`. "
+                    "Install it with `pip install se_gym[embedding]`."
+                ) from e
+            logger.info(f"Loading embedding model {self.model_name} on {self.device}")
+            self._model = SentenceTransformer(
+                self.model_name, device=self.device, local_files_only=config.EMBEDDING_OFFLINE
+            )
+        return self._model
+
+    def embed(self, texts: typing.List[str]) -> np.ndarray:
+        """
+        Embed a list of texts into a `(len(texts), dim)` float32 matrix, only running the model on
+        texts that are not cached yet.
+        """
+        keys = [content_hash(t) for t in texts]
+        found, missing = {}, {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                found[key] = self._cache[key]
+            else:
+                missing[key] = text
+        if missing:
+            logger.debug(f"Embedding {len(missing)} of {len(texts)} texts, rest is cached")
+            vectors = self.model.encode(
+                list(missing.values()),
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+            for key, vector in zip(missing.keys(), vectors):
+                found[key] = self._cache[key] = np.asarray(vector, dtype=np.float32)
+            while len(self._cache) > config.EMBEDDING_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self.embed([query])[0]
+
+
+class EmbeddingIndex:
+    """
+    All document vectors in one contiguous matrix. Vectors are expected to be normalized, so the
+    dot product is the cosine similarity. The matrix can be stored as float32, float16 or int8 (with
+    one scale per row) to trade precision for memory.
+    """
+
+    CHUNK_ROWS = 65536  # rows upcast to float32 at once when searching a quantized matrix
+
+    def __init__(self, dtype: typing.Literal["float32", "float16", "int8"] = "float32"):
+        if dtype not in ("float32", "float16", "int8"):
+            raise NotImplementedError(f"Dtype {dtype} not implemented")
+        self.dtype = dtype
+        self.ids: typing.List[str] = []
+        self._matrix = np.empty((0, 0), dtype=dtype)
+        self._scales = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, ids: typing.List[str], vectors: np.ndarray):
+        """
+        Replace the content of the index.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        assert len(ids) == len(vectors), "Every vector needs an id"
+        self.ids = list(ids)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1, keepdims=True) / 127.0 if len(vectors) else None
+            if scales is not None:
+                scales[scales == 0] = 1.0
+                self._matrix = np.ascontiguousarray(np.round(vectors / scales).astype(np.int8))
+                self._scales = scales.ravel().astype(np.float32)
+            else:
+                self._matrix = np.empty((0, 0), dtype=np.int8)
+                self._scales = None
+        else:
+            self._matrix = np.ascontiguousarray(vectors.astype(self.dtype))
+            self._scales = None
+
+    def clear(self):
+        self.build([], np.empty((0, 0), dtype=np.float32))
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        if self.dtype == "float32":
+            return self._matrix @ queries.T
+        scores = np.empty((len(self._matrix), len(queries)), dtype=np.float32)
+        for start in range(0, len(self._matrix), self.CHUNK_ROWS):
+            chunk = self._matrix[start : start + self.CHUNK_ROWS].astype(np.float32)
+            scores[start : start + self.CHUNK_ROWS] = chunk @ queries.T
+        if self._scales is not None:
+            scores *= self._scales[:, None]
+        return scores
+
+    def search(self, queries: np.ndarray, top_k: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the `top_k` closest vectors for every query.
+
+        Args:
+            queries (np.ndarray): One query vector `(dim,)` or a batch of queries `(n, dim)`.
+            top_k (int): Number of results per query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Row indices and scores, both of shape `(n, k)`, sorted by
+                descending score. `k` is smaller than `top_k` if the index holds fewer vectors.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(top_k, len(self.ids))
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        scores = self._scores(queries).T  # (n, num_docs), a single matrix product for the batch
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (len(queries), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def save(self, path: str):
+        """
+        Save the index to the directory `path`. The matrix is written as `.npy` so it can be memory
+        mapped by `load`.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "matrix.npy"), self._matrix)
+        if self._scales is not None:
+            np.save(os.path.join(path, "scales.npy"), self._scales)
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"dtype": self.dtype, "ids": self.ids}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "EmbeddingIndex":
+        """
+        Load an index saved with `save`. With `mmap=True` the matrix is not read into memory, but
+        memory mapped read-only.
+        """
+        with open(os.path.join(path, "index.json"), "r") as f:
+            meta = json.load(f)
+        index = cls(dtype=meta["dtype"])
+        index.ids = meta["ids"]
+        index._matrix = np.load(os.path.join(path, "matrix.npy"), mmap_mode="r" if mmap else None)
+        if os.path.exists(os.path.join(path, "scales.npy")):
+            index._scales = np.load(os.path.join(path, "scales.npy"))
+        return index
+
+
+@haystack.component
+class EmbeddingRetriever:
+    """
+    Embeds the query with a `LocalEmbedder` and retrieves the closest documents from an
+    `EmbeddingIndex`. The index has to be filled with the same embedder, see `observe.Store.update`.
+    """
+
+    def __init__(
+        self,
+        document_store: InMemoryDocumentStore,
+        embedder: LocalEmbedder,
+        index: typing.Optional[EmbeddingIndex] = None,
+        top_k: int = config.RAG_TOP_N,
+    ):
+        self.document_store = document_store
+        self.embedder = embedder
+        self.index = index if index is not None else EmbeddingIndex()
+        self.top_k = top_k
+        self.timings = {}
+
+    def run_batch(
+        self, queries: typing.List[str], top_k: typing.Optional[int] = None
+    ) -> typing.List[typing.List[haystack.Document]]:
+        """
+        Retrieve documents for many queries at once, e.g. for a whole population.
+        """
+        start = time.perf_counter()
+        query_embeddings = self.embedder.embed(queries)
+        embedded = time.perf_counter()
+        rows, scores = self.index.search(query_embeddings, top_k or self.top_k)
+        storage = self.document_store.storage
+        results = []
+        for query_rows, query_scores in zip(rows, scores):
+            docs = []
+            for row, score in zip(query_rows, query_scores):
+                doc = storage.get(self.index.ids[row])
+                if doc is not None:
+                    docs.append(dataclasses.replace(doc, score=float(score)))
+            results.append(docs)
+        self.timings = {
+            "embed_query": embedded - start,
+            "search": time.perf_counter() - embedded,
+        }
+        return results
+
+    @haystack.component.output_types(documents=typing.List[haystack.Document])
+    def run(self, query: str, top_k: typing.Optional[int] = None):
+        return {"documents": self.run_batch([query], top_k=top_k)[0]}
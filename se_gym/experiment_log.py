@@ -0,0 +1,247 @@
+"""
+Append-only experiment log. Rows are buffered and written by a background thread as new parquet
+part files into a directory, which can be read as one table.
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import typing
+import uuid
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["ExperimentLog", "read", "compact", "migrate"]
+
+# name -> pyarrow type name, see `schema`
+FIELDS = dict(
+    timestamp="float64",  # unix time the row was logged
+    run_id="string",
+    model="string",
+    epoch="int64",
+    issue="string",
+    individual_i="int64",
+    individual="string",  # the prompt
+    timestep="int64",
+    patch="string",
+    score="float64",
+    fitness="float64",
+    time="float64",  # seconds of the step, as logged by the demo
+    timings="map<string, float64>",
+    retries="int64",
+    prompt_tokens="int64",
+    completion_tokens="int64",
+    extra="string",  # JSON of all other logged values
+)
+
+
+def schema():
+    import pyarrow as pa  # delayed import to avoid slow startup
+
+    types = {
+        "float64": pa.float64(),
+        "int64": pa.int64(),
+        "string": pa.string(),
+        "map<string, float64>": pa.map_(pa.string(), pa.float64()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in FIELDS.items()])
+
+
+def _convert(value, kind: str):
+    if value is None:
+        return None
+    if kind == "string":
+        return str(value)
+    if kind == "int64":
+        return int(value)
+    if kind == "float64":
+        return float(value)
+    return [(str(k), float(v)) for k, v in dict(value).items()]
+
+
+def _row(values: dict, **defaults) -> dict:
+    """
+    One row of the log. Values of unknown fields, and values that do not convert to the type of
+    their field, are kept as JSON in `extra`.
+    """
+    row = {name: None for name in FIELDS}
+    row.update(defaults)
+    extra = {}
+    for name, value in values.items():
+        if name in FIELDS and name != "extra":
+            try:
+                row[name] = _convert(value, FIELDS[name])
+                continue
+            except (TypeError, ValueError):
+                row[name] = None
+        extra[name] = value
+    row["extra"] = json.dumps(extra, default=str) if extra else None
+    return row
+
+
+def _write_part(directory: str, name: str, rows: typing.List[dict]):
+    """
+    Write a part file, to a temporary file first, so readers never see partial parts.
+    """
+    import pyarrow as pa  # delayed import to avoid slow startup
+    import pyarrow.parquet as pq
+
+    os.makedirs(directory, exist_ok=True)
+    temp = os.path.join(directory, f".{name}.tmp")
+    pq.write_table(pa.Table.from_pylist(rows, schema=schema()), temp)
+    os.replace(temp, os.path.join(directory, name))
+
+
+class ExperimentLog:
+    """
+    Buffered, append-only log of experiment rows (see `FIELDS`; values for unknown fields are kept
+    as JSON in `extra`). Rows are written when `flush_rows` rows are buffered or every
+    `flush_interval` seconds by a background thread. Every flush writes a new part file (written to
+    a temporary file first and then renamed), so several processes can log into the same directory
+    and a crash loses at most the buffered rows.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        run_id: typing.Optional[str] = None,
+        flush_rows: int = config.EXPERIMENT_LOG_FLUSH_ROWS,
+        flush_interval: float = config.EXPERIMENT_LOG_FLUSH_SECONDS,
+    ):
+        self.directory = directory
+        self.run_id = run_id or uuid.uuid4().hex
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._buffer: typing.List[dict] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._num_parts = 0
+        self._thread = threading.Thread(target=self._run, name="se_gym-experiment-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, **values):
+        """
+        Buffer one row.
+        """
+        if self._closed:
+            raise ValueError("The experiment log is closed")
+        row = _row(values, timestamp=time.time(), run_id=self.run_id)
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.error("Failed to write the experiment log", exc_info=True)
+
+    def flush(self):
+        """
+        Write all buffered rows into a new part file.
+        """
+        with self._write_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            name = f"part-{self.run_id}-{os.getpid()}-{self._num_parts:06d}.parquet"
+            self._num_parts += 1
+            _write_part(self.directory, name, rows)
+
+    def close(self):
+        """
+        Stop the background thread and write the remaining rows.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def dataset(path: str):
+    """
+    The log at `path` (a directory of part files or a single parquet file) as a lazy
+    `pyarrow.dataset.Dataset`, e.g. to filter or select columns before reading.
+    """
+    import pyarrow.dataset as ds  # delayed import to avoid slow startup
+
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, "*.parquet")))
+        return ds.dataset(files, format="parquet", schema=schema())
+    return ds.dataset(path, format="parquet")
+
+
+def read(path: str, columns: typing.Optional[typing.List[str]] = None):
+    """
+    Read the log at `path` into a pandas DataFrame, only loading `columns` if given.
+    """
+    return dataset(path).to_table(columns=columns).to_pandas()
+
+
+def compact(directory: str):
+    """
+    Merge all part files of a directory into one part file, to speed up reading many small parts.
+    Only run this while nobody is logging into the directory.
+    """
+    import pyarrow.parquet as pq  # delayed import to avoid slow startup
+
+    files = sorted(glob.glob(os.path.join(directory, "*.parquet")))
+    if len(files) < 2:
+        return
+    name = f"part-compacted-{uuid.uuid4().hex}.parquet"
+    temp = os.path.join(directory, f".{name}.tmp")
+    pq.write_table(dataset(directory).to_table(), temp)
+    os.replace(temp, os.path.join(directory, name))
+    for file in files:
+        os.remove(file)
+
+
+def migrate(path: str):
+    """
+    Turn a log written as a single parquet file by older versions into a directory of part files at
+    the same path. The old rows, converted to the current schema, become its first part.
+    """
+    import pyarrow.parquet as pq  # delayed import to avoid slow startup
+
+    old = f"{path}.{uuid.uuid4().hex}.old"
+    try:
+        os.replace(path, old)
+    except FileNotFoundError:  # migrated by another process meanwhile
+        return
+    try:
+        rows = [_row(values) for values in pq.read_table(old).to_pylist()]
+        _write_part(path, "part-0-migrated.parquet", rows)  # "-" sorts before all run ids
+    except BaseException:
+        if not glob.glob(os.path.join(path, "*.parquet")):  # nobody logged into it meanwhile
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(old, path)
+        else:
+            logger.error(f"Could not migrate the experiment log {path}, the old file is at {old}")
+        raise
+    os.remove(old)
+    logger.info(f"Migrated the experiment log {path} into a directory of part files")
@@ -3,8 +3,15 @@ This module contains possible fitness functions.
 """
 
 from . import api
+from . import cache
+from . import config
+from . import runner_host
+from . import testlog
+import collections
 import logging
+import os
 import typing
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -42,18 +49,282 @@ def num_failed_tests(test_results: typing.Union[api.State, dict]) -> int:
     if not test_results:
         logger.info("No test results found")
         return 0
+    if isinstance(test_results, testlog.TestLog):
+        return test_results.num_failing()
     return len(
         [k for k, v in test_results.items() if v["status"] == "failed" or v["status"] == "error"]
     )
 
 
-def execution_speed() -> float:
+SAMPLING_STAGES = ("update", "retrieval", "packing", "generation", "validation")
+
+
+def execution_speed(state: api.State, include_tests: bool = False) -> float:
     """
     Calculate the end-to-end execution speed of the LLM generation. This might incentivize the solver to generate correct patches faster (no retries), but might also incentivize the solver to generate less tests.
+
+    Args:
+        state (api.State): The state after the step, see `State.stats`.
+        include_tests (bool): Also count the time spent starting the container and running the tests.
+
+    Returns:
+        float: `1 / (1 + seconds)` of the last step, in (0, 1]. Higher is better. 0 for invalid states.
     """
+    if isinstance(state, api.InvalidState) or not state.stats:
+        return 0
+    timings = state.stats[-1]["timings"]
+    if include_tests:
+        seconds = sum(timings.values())
+    else:
+        seconds = sum(v for k, v in timings.items() if k in SAMPLING_STAGES)
+    return 1 / (1 + seconds)
 
 
-def number_retries() -> float:
+def number_retries(state: api.State) -> float:
     """
     Calculate the number of iterations a model needs to fix an issue. This might incentivize the solver to create larger patches, fixing multiple steps at once.
+
+    Every step after the first and every invalid output of the model (see `State.stats`) counts as
+    one retry.
+
+    Returns:
+        float: The number of retries in the episode so far. Lower is better.
+    """
+    return max(len(state.stats) - 1, 0) + sum(s.get("retries", 0) for s in state.stats)
+
+
+MISSING = -1  # status code of tests that did not run for an individual
+TestResults = typing.Union[api.State, testlog.TestLog, dict, None]
+
+
+def _latest_results(results: TestResults) -> typing.Optional[testlog.TestLog]:
+    if isinstance(results, api.InvalidState):
+        return None
+    if isinstance(results, api.State):
+        results = results.logs[-1] if results.logs else None
+    if not results:
+        return None
+    return testlog.TestLog.from_results(results)
+
+
+def status_matrix(
+    results: typing.List[TestResults],
+) -> typing.Tuple[typing.Tuple[str, ...], np.ndarray, np.ndarray]:
+    """
+    Convert the latest test results of many individuals into one status matrix.
+
+    Returns:
+        Tuple[Tuple[str, ...], np.ndarray, np.ndarray]: The test ids (columns), the int8 status
+            matrix of shape `(individuals, tests)` with codes from `testlog.STATUSES` (`MISSING` if
+            a test did not run) and a boolean array marking individuals without valid results.
+    """
+    logs = [_latest_results(r) for r in results]
+    positions, seen = {}, set()
+    for log in logs:
+        if log is not None and id(log.test_ids) not in seen:  # test ids are shared between logs
+            seen.add(id(log.test_ids))
+            for test_id in log.test_ids:
+                positions.setdefault(test_id, len(positions))
+    test_ids = tuple(positions)
+    matrix = np.full((len(logs), len(test_ids)), MISSING, dtype=np.int8)
+    for row, log in enumerate(logs):
+        if log is None:
+            continue
+        if log.test_ids == test_ids:  # all individuals usually run the same tests
+            matrix[row] = log.status
+        else:
+            matrix[row, [positions[t] for t in log.test_ids]] = log.status
+    return test_ids, matrix, np.array([log is None for log in logs], dtype=bool)
+
+
+def _suffix_counts(module_index: typing.Dict[str, str]) -> typing.Dict[str, int]:
+    """
+    Number of files of a `module_index` that each path suffix names, e.g. `b/c.py` names both
+    `a/b/c.py` and `b/c.py`.
+    """
+    counts = collections.Counter()
+    for file in set(module_index.values()):
+        parts = file.split("/")
+        counts.update("/".join(parts[i:]) for i in range(len(parts)))
+    return counts
+
+
+def _test_id_prefixes(
+    test: str,
+    module_index: typing.Optional[typing.Dict[str, str]] = None,
+    suffix_counts: typing.Optional[typing.Dict[str, int]] = None,
+) -> typing.List[str]:
+    """
+    Dotted prefixes a test id of the test runner can start with, for a FAIL_TO_PASS entry that is a
+    test file path, a pytest node id or a unittest id `name (module.Class)`.
+
+    The test runner may name a module relative to a different root than the entry, so every suffix
+    of the module path is a candidate, but only suffixes that still contain the module itself: a
+    bare package like `tests` would match every test. With a `module_index` (see
+    `runner_host.build_module_index`), the path is resolved against the repository and only suffixes
+    that name only this file there are kept. Directories and unresolvable dotted ids give no prefix.
+    Pass the `_suffix_counts` of the index when resolving many tests against the same index.
     """
+    if "(" in test and test.rstrip().endswith(")"):
+        name, dotted = test.rstrip(")").split("(", 1)
+        return [f"{dotted.strip()}.{name.strip()}"]
+    path, _, rest = test.partition("::")
+    path = path.replace("\\", "/")
+    suffix = "." + rest.replace("::", ".") if rest else ""
+    if not path.endswith(".py"):
+        if "/" in path or module_index is None:
+            return [] if "/" in path else [path]
+        parts = path.split(".")  # a dotted module or test id, which has to reach a module
+        modules = ("/".join(parts[:i]) + ".py" for i in range(1, len(parts) + 1))
+        return [path] if any(m in module_index for m in modules) else []
+    if module_index is not None:
+        names = path.split("/")
+        candidates = ("/".join(names[i:]) for i in range(len(names)))
+        path = next((module_index[c] for c in candidates if c in module_index), path)
+    if module_index is not None and suffix_counts is None:
+        suffix_counts = _suffix_counts(module_index)
+    parts = path.removesuffix(".py").split("/")
+    prefixes = []
+    for i in range(len(parts)):
+        name = "/".join(parts[i:]) + ".py"
+        if module_index is not None and (
+            suffix_counts.get(name, 0) != 1 or module_index[name] != path
+        ):
+            continue  # ambiguous or names a different file of the repository
+        module = parts[i:]
+        if module[-1] == "__init__":  # the module is the package itself
+            module = module[:-1]
+            if not module or not rest:
+                continue
+        prefixes.append(".".join(module) + suffix)
+    return prefixes
+
+
+def _state_module_index(
+    results: typing.List[TestResults],
+) -> typing.Optional[typing.Dict[str, str]]:
+    """
+    Module index of the repository of the first state, cached like in `api.Environment`.
+    """
+    for state in results:
+        if isinstance(state, api.State) and state.path and os.path.isdir(state.path):
+            disk_cache = cache.DiskCache(namespace="module_index")
+            return disk_cache.get_or_compute(
+                disk_cache.key(state.repo, state.setup_commit),
+                runner_host.build_module_index,
+                state.path,
+            )
+    return None
+
+
+def fail_to_pass_mask(
+    test_ids: typing.Sequence[str],
+    fail_to_pass: typing.List[str],
+    module_index: typing.Optional[typing.Dict[str, str]] = None,
+) -> np.ndarray:
+    """
+    Boolean mask of the test ids that belong to the FAIL_TO_PASS tests, see `_test_id_prefixes`.
+    """
+    counts = _suffix_counts(module_index) if module_index is not None else None
+    prefixes = tuple(
+        p for test in fail_to_pass for p in _test_id_prefixes(test, module_index, counts)
+    )
+    return np.array(
+        [any(t == p or t.startswith(p + ".") for p in prefixes) for t in test_ids], dtype=bool
+    )
+
+
+def batch_metrics(
+    results: typing.List[TestResults],
+    fail_to_pass: typing.Optional[typing.List[str]] = None,
+    baseline: TestResults = None,
+    module_index: typing.Optional[typing.Dict[str, str]] = None,
+) -> typing.Dict[str, np.ndarray]:
+    """
+    Compute fitness metrics for a whole generation at once.
+
+    Args:
+        results (List): The states (or test results) of all individuals.
+        fail_to_pass (List[str], optional): FAIL_TO_PASS tests, as test ids or test files.
+        baseline (optional): Test results of the unpatched repository, used to count regressions.
+        module_index (Dict[str, str], optional): Index of the repository to resolve the
+            FAIL_TO_PASS files against, built from the path of the first state by default.
+
+    Returns:
+        Dict[str, np.ndarray]: Arrays with one entry per individual: `pass_rate` (like
+            `percent_successfull`), `num_failed` (like `num_failed_tests`), `fail_to_pass_rate`
+            (share of FAIL_TO_PASS tests that pass), `regressions` (tests passing in the baseline
+            but failing now), `regression_rate`, `execution_speed` and `retries` (see
+            `execution_speed` and `number_retries`, 0 if the results are not states).
+    """
+    test_ids, matrix, invalid = status_matrix(results)
+    ran = matrix != MISSING
+    failing = np.isin(matrix, testlog.FAILING)
+    num_ran = ran.sum(axis=1)
+    num_failed = failing.sum(axis=1)
+    pass_rate = np.divide(
+        num_ran - num_failed, num_ran, out=np.zeros(len(matrix)), where=num_ran > 0
+    )
+
+    fail_to_pass_rate = np.zeros(len(matrix))
+    if fail_to_pass:
+        if module_index is None:
+            module_index = _state_module_index(results)
+        mask = fail_to_pass_mask(test_ids, fail_to_pass, module_index)
+        num_f2p = (ran & mask).sum(axis=1)
+        fixed = (ran & ~failing & mask).sum(axis=1)
+        fail_to_pass_rate = np.divide(fixed, num_f2p, out=fail_to_pass_rate, where=num_f2p > 0)
+
+    regressions = np.zeros(len(matrix), dtype=np.int64)
+    regression_rate = np.zeros(len(matrix))
+    baseline = _latest_results(baseline)
+    if baseline is not None:
+        positions = {t: i for i, t in enumerate(test_ids)}
+        passing_before = np.zeros(len(test_ids), dtype=bool)
+        for test_id, status in zip(baseline.test_ids, baseline.status):
+            if test_id in positions and status not in testlog.FAILING:
+                passing_before[positions[test_id]] = True
+        regressions = (failing & passing_before).sum(axis=1)
+        num_passing_before = passing_before.sum()
+        if num_passing_before:
+            regression_rate = regressions / num_passing_before
+
+    for metric in (pass_rate, fail_to_pass_rate, regression_rate):
+        metric[invalid] = 0
+    regressions[invalid] = 0
+    num_failed[invalid] = 0
+    states = [r if isinstance(r, api.State) else None for r in results]
+    speed = np.array([execution_speed(s) if s is not None else 0 for s in states], dtype=float)
+    retries = np.array([number_retries(s) if s is not None else 0 for s in states], dtype=float)
+    return dict(
+        pass_rate=pass_rate,
+        num_failed=num_failed,
+        fail_to_pass_rate=fail_to_pass_rate,
+        regressions=regressions,
+        regression_rate=regression_rate,
+        execution_speed=speed,
+        retries=retries,
+    )
+
+
+def batch_fitness(
+    results: typing.List[TestResults],
+    fail_to_pass: typing.Optional[typing.List[str]] = None,
+    baseline: TestResults = None,
+    weights: typing.Optional[typing.Dict[str, float]] = None,
+    module_index: typing.Optional[typing.Dict[str, str]] = None,
+) -> np.ndarray:
+    """
+    Weighted fitness of a whole generation, see `batch_metrics` for the metrics. The default weights
+    (`config.FITNESS_WEIGHTS`) only use the pass rate, i.e. `percent_successfull`. Regressions are
+    subtracted. The result can be passed to `genetic.Population.evolve`.
+    """
+    weights = weights if weights is not None else config.FITNESS_WEIGHTS
+    metrics = batch_metrics(
+        results, fail_to_pass=fail_to_pass, baseline=baseline, module_index=module_index
+    )
+    score = np.zeros(len(results))
+    for name, weight in weights.items():
+        sign = -1 if name in ("regressions", "regression_rate", "num_failed", "retries") else 1
+        score += sign * weight * metrics[name]
+    return score
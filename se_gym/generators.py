@@ -3,8 +3,11 @@ import haystack
 import pydantic
 import typing
 import logging
+import time
+import threading
 from . import utils
 from . import config
+from . import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +55,15 @@ class CustomGenerator:
         self.schema = schema
         self.no_verify = no_verify
         self.model_name = model_config.get("model_name", "unknown")
+        self._stats_lock = threading.Lock()  # run may be called from several threads
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the accumulated number of calls, seconds and tokens used by this generator.
+        """
+        with self._stats_lock:
+            self.stats = dict(calls=0, seconds=0.0, prompt_tokens=0, completion_tokens=0)
 
     @staticmethod
     def format_messages(messages: typing.Union[typing.List[typing.Dict[str, str]], str]):
@@ -93,13 +105,24 @@ class CustomGenerator:
         else:
             rf = dict()
 
-        completion = self.client.beta.chat.completions.parse(
-            model=self.model_name,
-            messages=messages,
-            **rf,
-            **kwargs,
-            timeout=config.LLM_TIMEOUT,
-        )
+        start = time.perf_counter()
+        with tracing.span("llm", model=self.model_name) as span:
+            completion = self.client.beta.chat.completions.parse(
+                model=self.model_name,
+                messages=messages,
+                **rf,
+                **kwargs,
+                timeout=config.LLM_TIMEOUT,
+            )
+            if completion.usage is not None:
+                span.set_tag("prompt_tokens", completion.usage.prompt_tokens)
+                span.set_tag("completion_tokens", completion.usage.completion_tokens)
+        with self._stats_lock:
+            self.stats["calls"] += 1
+            self.stats["seconds"] += time.perf_counter() - start
+            if completion.usage is not None:
+                self.stats["prompt_tokens"] += completion.usage.prompt_tokens or 0
+                self.stats["completion_tokens"] += completion.usage.completion_tokens or 0
 
         choices = completion.choices[0]
         content = choices.message.content
@@ -2,13 +2,20 @@
 This module contains a possible genetic algorithm implementation for LLM prompt optimization, compatible with PyGAD.
 """
 
+import collections
+import concurrent.futures
+import dataclasses
 import typing
 import pydantic
 import random
 import logging
+import numpy as np
+from . import api
+from . import archive
 from . import config
 from . import sampler2
 from . import generators
+from . import tracing
 
 __all__ = ["Population", "LLMPopulation"]
 
@@ -88,6 +95,14 @@ Based on the parent prompt, create a new prompt that is similar to the parent pr
 """
 
 
+@dataclasses.dataclass
+class _Episode:
+    individual: prompt
+    state: api.State
+    rewards: typing.List[float] = dataclasses.field(default_factory=list)
+    archived: bool = False  # rewards were taken from the fitness archive
+
+
 class Population:
     def __init__(
         self,
@@ -96,6 +111,7 @@ class Population:
         percent_elite: float = 0.0,
         percent_mutation: float = 1.0,
         percent_crossover: float = 0.0,
+        fitness_archive: typing.Optional[archive.FitnessArchive] = None,
     ):
         assert (
             percent_elite + percent_mutation + percent_crossover <= 1
@@ -103,6 +119,7 @@ class Population:
         self.individuals = initial_individuals
         logger.debug(f"New population: {self.individuals}")
         self.sampler = sampler
+        self.fitness_archive = fitness_archive
         self.num_elite = int(percent_elite * len(self.individuals))
         self.num_mutation = int(percent_mutation * len(self.individuals))
         self.num_crossover = int(percent_crossover * len(self.individuals))
@@ -163,22 +180,28 @@ class Population:
         new_population = []
         new_population.extend([x[0] for x in sorted_population[: self.num_elite]])
 
+        requests = []  # mutation and crossover requests are sent to the LLM concurrently
         if self.num_mutation > 0:
             to_mutate = random.sample(sorted_population[self.num_elite :], self.num_mutation)
             for ind, fit in to_mutate:
-                new_population.append(self._mutate(ind, fit))
+                requests.append((self._mutate, ind, fit))
 
         if self.num_crossover > 0:
             to_crossover = random.sample(sorted_population, self.num_crossover * 2)
             for i in range(0, len(to_crossover), 2):
-                new_population.extend(
-                    self._crossover(
+                requests.append(
+                    (
+                        self._crossover,
                         to_crossover[i][0],
                         to_crossover[i + 1][0],
                         to_crossover[i][1],
                         to_crossover[i + 1][1],
                     )
                 )
+        with concurrent.futures.ThreadPoolExecutor(config.EVO_CONCURRENCY) as executor:
+            children = executor.map(lambda r: r[0](*r[1:]), requests)
+            for child in children:
+                new_population.extend(child if isinstance(child, tuple) else [child])
 
         while len(new_population) < len(self.individuals):
             rand = random.choice(self.individuals)
@@ -189,8 +212,10 @@ class Population:
 
     def evolve(self, fitnesses):
         """
-        Update the population based on the fitness scores.
+        Update the population based on the fitness scores, e.g. from `fitness.batch_fitness`.
         """
+        if isinstance(fitnesses, np.ndarray):
+            fitnesses = fitnesses.tolist()
         return self._selection(fitnesses)
 
     def sample(self, states):
@@ -219,7 +244,268 @@ class Population:
             )
         except Exception:
             logger.warning(f"Failed to sample {individual}. ", exc_info=True)
-            return ""
+            return api.Action("", **getattr(self.sampler, "last_stats", {}))
+
+    def _archive_key(
+        self,
+        individual: prompt,
+        env: api.Environment,
+        reward: typing.Callable[[api.State], float],
+        max_steps: int,
+        target: float,
+    ) -> archive.ArchiveKey:
+        sampler_hash = (
+            self.sampler.config_hash()
+            if hasattr(self.sampler, "config_hash")
+            else type(self.sampler).__name__
+        )
+        return archive.FitnessArchive.key(
+            individual, env.current_instance_id, sampler_hash, reward, max_steps, target
+        )
+
+    def _fitness(
+        self,
+        rewards: typing.List[float],
+        aggregate: typing.Callable[[typing.List[float]], float],
+        key: typing.Optional[archive.ArchiveKey] = None,
+    ) -> float:
+        """
+        Fitness of an individual. With a fitness archive, this is the mean over all episodes of
+        `key`.
+        """
+        if self.fitness_archive is None:
+            return aggregate(rewards) if rewards else 0
+        return self.fitness_archive.fitness(key, aggregate)
+
+    def fitnesses(
+        self,
+        env: api.Environment,
+        rewards: typing.List[typing.List[float]],
+        reward: typing.Callable[[api.State], float],
+        max_steps: int = 1,
+        target: float = 1.0,
+        aggregate: typing.Callable[[typing.List[float]], float] = max,
+    ) -> typing.List[float]:
+        """
+        Fitness of every individual from the rewards returned by `evaluate` with the same `reward`,
+        `max_steps` and `target` (averaged over all episodes in the fitness archive, if there is
+        one).
+        """
+        return [
+            self._fitness(
+                r, aggregate, self._archive_key(individual, env, reward, max_steps, target)
+            )
+            for individual, r in zip(self.individuals, rewards)
+        ]
+
+    @staticmethod
+    def _test(env: api.Environment, action: api.Action, state: api.State) -> api.State:
+        try:
+            return env.step(action, state)
+        except Exception:
+            logger.warning("Failed to test action", exc_info=True)
+            stats = dict(
+                timings=dict(getattr(action, "timings", {})),
+                retries=getattr(action, "retries", 0),
+                usage=dict(getattr(action, "usage", {})),
+            )
+            return api.InvalidState.from_state(state.with_stats(stats))
+
+    def _run_pipeline(
+        self,
+        env: api.Environment,
+        state: api.State,
+        individuals: typing.List[prompt],
+        reward: typing.Callable[[api.State], float],
+        max_steps: int,
+        target: float,
+        test_workers: int,
+        on_finished: typing.Callable[
+            [_Episode], typing.List[typing.Callable[[], typing.List[prompt]]]
+        ],
+    ):
+        """
+        Run one episode per individual, starting at `state`. Sampling happens one action at a time
+        in the calling thread (the sampler works on the shared host checkout), while up to
+        `test_workers` actions are tested concurrently, so testing an action overlaps with sampling
+        the next one. An episode ends after `max_steps` steps or once the reward reaches `target`.
+        Episodes of individuals that are known in the fitness archive are not run again, their
+        latest rewards are taken from the archive instead. All other episodes are archived.
+        `on_finished` is called with every finished episode and may return requests (callables
+        returning new individuals, e.g. mutations). They run in a separate thread pool and their
+        individuals are evaluated as soon as they are available.
+        """
+        ready = collections.deque(_Episode(individual, state) for individual in individuals)
+        pending = {}  # future -> episode, or None for mutation and crossover requests
+        with (
+            concurrent.futures.ThreadPoolExecutor(test_workers) as tests,
+            concurrent.futures.ThreadPoolExecutor(config.EVO_CONCURRENCY) as requests,
+        ):
+
+            def finish(episode):
+                if self.fitness_archive is not None and not episode.archived:
+                    key = self._archive_key(episode.individual, env, reward, max_steps, target)
+                    self.fitness_archive.add(key, episode.rewards)
+                for request in on_finished(episode) or []:
+                    pending[requests.submit(tracing.propagate(request))] = None
+
+            while ready or pending:
+                if ready:
+                    episode = ready.popleft()
+                    if self.fitness_archive is not None and not episode.rewards:
+                        key = self._archive_key(episode.individual, env, reward, max_steps, target)
+                        if self.fitness_archive.is_known(key):
+                            episode.rewards = list(self.fitness_archive.samples(key)[-1])
+                            episode.archived = True
+                            finish(episode)
+                            continue
+                    action = self.get_action(episode.individual, episode.state)
+                    test = tracing.propagate(self._test)
+                    pending[tests.submit(test, env, action, episode.state)] = episode
+                    finished = [f for f in pending if f.done()]
+                else:
+                    finished, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                for future in finished:
+                    episode = pending.pop(future)
+                    if episode is None:
+                        try:
+                            ready.extend(_Episode(child, state) for child in future.result())
+                        except Exception:
+                            logger.warning("Failed to create new individuals", exc_info=True)
+                        continue
+                    episode.state = future.result()
+                    episode.rewards.append(reward(episode.state))
+                    if len(episode.rewards) < max_steps and episode.rewards[-1] < target:
+                        ready.appendleft(episode)  # finish running episodes first
+                        continue
+                    finish(episode)
+
+    def evaluate(
+        self,
+        env: api.Environment,
+        reward: typing.Callable[[api.State], float],
+        issue: typing.Optional[int] = None,
+        max_steps: int = 1,
+        target: float = 1.0,
+        test_workers: int = config.TEST_WORKERS,
+        completed: typing.Optional[typing.List[typing.Tuple[prompt, typing.List[float]]]] = None,
+        on_episode: typing.Optional[typing.Callable[[prompt, typing.List[float]], None]] = None,
+    ) -> typing.List[typing.List[float]]:
+        """
+        Run one episode per individual on the same issue, with sampling and testing pipelined.
+
+        Args:
+            env (api.Environment): The environment, reset to `issue` once for all individuals.
+            reward (Callable): Reward of a state, e.g. `fitness.percent_successfull`.
+            issue (int, optional): Index of the issue. Random if not given.
+            max_steps (int): Maximum number of steps per episode.
+            target (float): An episode ends early once its reward reaches `target`.
+            test_workers (int): Number of actions tested concurrently.
+            completed (List, optional): `(individual, rewards)` of episodes that already ran, e.g.
+                restored from a checkpoint. They are not run again.
+            on_episode (Callable, optional): Called with the individual and its rewards whenever an
+                episode has finished.
+
+        Returns:
+            List[List[float]]: The rewards of every step, per individual. For individuals known in
+                the fitness archive, the rewards of their latest archived episode.
+        """
+        initial = env.reset(issue)
+        by_individual = collections.defaultdict(list)
+        for individual, rewards in completed or []:
+            by_individual[individual].append(list(rewards))
+        available = {k: len(v) for k, v in by_individual.items()}
+        remaining = []
+        for individual in self.individuals:
+            if available.get(individual, 0) > 0:
+                available[individual] -= 1
+            else:
+                remaining.append(individual)
+
+        def on_finished(episode):
+            by_individual[episode.individual].append(episode.rewards)
+            if on_episode is not None:
+                on_episode(episode.individual, episode.rewards)
+
+        self._run_pipeline(
+            env, initial, remaining, reward, max_steps, target, test_workers, on_finished
+        )
+        return [by_individual[individual].pop(0) for individual in self.individuals]
+
+    def run_generation(
+        self,
+        env: api.Environment,
+        reward: typing.Callable[[api.State], float],
+        issue: typing.Optional[int] = None,
+        max_steps: int = 1,
+        target: float = 1.0,
+        aggregate: typing.Callable[[typing.List[float]], float] = max,
+        test_workers: int = config.TEST_WORKERS,
+    ) -> typing.List[typing.List[float]]:
+        """
+        Evaluate the population (see `evaluate`) and evolve it, using `aggregate` of the rewards of
+        each episode as fitness (averaged over all episodes in the fitness archive, if there is one).
+        Returns the rewards.
+        """
+        rewards = self.evaluate(env, reward, issue, max_steps, target, test_workers)
+        self.evolve(self.fitnesses(env, rewards, reward, max_steps, target, aggregate))
+        return rewards
+
+    def run_steady_state(
+        self,
+        env: api.Environment,
+        reward: typing.Callable[[api.State], float],
+        num_requests: int,
+        issue: typing.Optional[int] = None,
+        max_steps: int = 1,
+        target: float = 1.0,
+        aggregate: typing.Callable[[typing.List[float]], float] = max,
+        tournament_size: int = 2,
+        test_workers: int = config.TEST_WORKERS,
+    ) -> typing.List[float]:
+        """
+        Steady-state evolution: as soon as the fitness of an individual is known, parents are
+        selected by tournament among the individuals evaluated so far and a mutation or crossover
+        request (in the ratio of `percent_mutation` to `percent_crossover`) is sent to the LLM. New
+        individuals are evaluated as soon as they arrive and replace the worst individual of the
+        population. Stops after `num_requests` requests and their evaluations.
+
+        Returns:
+            List[float]: The fitness of each individual of the final population.
+        """
+        size = len(self.individuals)
+        scored = []  # (individual, fitness) of the population
+        budget = [num_requests]
+        num_variations = self.num_mutation + self.num_crossover
+        p_crossover = self.num_crossover / num_variations if num_variations else 0
+
+        def tournament():
+            return max(random.sample(scored, min(tournament_size, len(scored))), key=lambda x: x[1])
+
+        def on_finished(episode):
+            key = self._archive_key(episode.individual, env, reward, max_steps, target)
+            fitness = self._fitness(episode.rewards, aggregate, key)
+            scored.append((episode.individual, fitness))
+            if len(scored) > size:
+                scored.remove(min(scored, key=lambda x: x[1]))
+            if budget[0] <= 0:
+                return []
+            budget[0] -= 1
+            if len(scored) >= 2 and random.random() < p_crossover:
+                (parent1, fitness1), (parent2, fitness2) = tournament(), tournament()
+                return [lambda: list(self._crossover(parent1, parent2, fitness1, fitness2))]
+            parent, fitness = tournament()
+            return [lambda: [self._mutate(parent, fitness)]]
+
+        initial = env.reset(issue)
+        self._run_pipeline(
+            env, initial, self.individuals, reward, max_steps, target, test_workers, on_finished
+        )
+        self.individuals = [individual for individual, _ in scored]
+        logger.debug(f"New population: {self.individuals}")
+        return [fitness for _, fitness in scored]
 
 
 class LLMPopulation:
@@ -0,0 +1,251 @@
+"""
+Island model for the genetic search: several populations evolve in separate processes and
+periodically exchange their best individuals.
+"""
+
+import concurrent.futures
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import tempfile
+import time
+import typing
+import uuid
+
+from . import api
+from . import config
+from . import fitness
+from . import genetic
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["QueueBroker", "FileBroker", "IslandModel"]
+
+Migrant = typing.Tuple[str, float]  # (individual, fitness)
+IslandFactory = typing.Callable[[int], typing.Tuple[genetic.Population, api.Environment]]
+
+
+class QueueBroker:
+    """
+    Exchanges migrants through one `multiprocessing` queue per island. Only works for islands on
+    the same machine.
+    """
+
+    def __init__(self, num_islands: int, manager: typing.Optional[multiprocessing.Manager] = None):
+        manager = manager or multiprocessing.Manager()
+        self.queues = [manager.Queue() for _ in range(num_islands)]
+
+    def send(self, target: int, migrants: typing.List[Migrant]):
+        self.queues[target].put(list(migrants))
+
+    def receive(
+        self, island: int, expected: int = 0, timeout: typing.Optional[float] = None
+    ) -> typing.List[Migrant]:
+        """
+        The migrants of the next `expected` batches (one per `send`) sent to `island`, in the order
+        they were sent, waiting up to `timeout` seconds for them. Later batches stay queued for the
+        next call. With `expected=0`, all batches that have arrived.
+        """
+        migrants, batches = [], 0
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not expected or batches < expected:
+            try:
+                if expected:
+                    wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+                    batch = self.queues[island].get(timeout=wait)
+                else:
+                    batch = self.queues[island].get_nowait()
+            except queue.Empty:
+                if expected:
+                    logger.warning(f"Island {island} received {batches} of {expected} migrations")
+                break
+            migrants.extend(tuple(m) for m in batch)
+            batches += 1
+        return migrants
+
+
+class FileBroker:
+    """
+    Exchanges migrants through JSON files in `directory/island_<id>`. Files are written atomically,
+    so the directory can also be on a shared file system between several machines.
+    """
+
+    POLL_SECONDS = 0.2  # interval between checks of the inbox while waiting for migrants
+
+    def __init__(self, directory: typing.Optional[str] = None):
+        self.directory = directory or tempfile.mkdtemp(prefix="se_gym_islands_")
+
+    def _inbox(self, island: int) -> str:
+        path = os.path.join(self.directory, f"island_{island}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def send(self, target: int, migrants: typing.List[Migrant]):
+        inbox = self._inbox(target)
+        name = f"{time.time():.6f}_{uuid.uuid4().hex}"
+        temp = os.path.join(inbox, f".{name}.tmp")
+        with open(temp, "w") as f:
+            json.dump(list(migrants), f)
+        os.replace(temp, os.path.join(inbox, f"{name}.json"))
+
+    def receive(
+        self, island: int, expected: int = 0, timeout: typing.Optional[float] = None
+    ) -> typing.List[Migrant]:
+        """
+        The migrants of the next `expected` batches (one per `send`) sent to `island`, in the order
+        they were sent, polling up to `timeout` seconds for them. Later batches stay in the inbox
+        for the next call. With `expected=0`, all batches that have arrived.
+        """
+        migrants, batches = [], 0
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            paths = sorted(glob.glob(os.path.join(self._inbox(island), "*.json")))
+            for path in paths[: expected - batches] if expected else paths:
+                try:
+                    with open(path, "r") as f:
+                        migrants.extend(tuple(m) for m in json.load(f))
+                    os.remove(path)
+                    batches += 1
+                except (OSError, json.JSONDecodeError):
+                    logger.warning(f"Could not read migrants from {path}", exc_info=True)
+            if batches >= expected:
+                return migrants
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"Island {island} received {batches} of {expected} migrations")
+                return migrants
+            time.sleep(self.POLL_SECONDS)
+
+
+Broker = typing.Union[QueueBroker, FileBroker]
+
+
+def _run_island(
+    island: int,
+    make_island: IslandFactory,
+    reward: typing.Callable[[api.State], float],
+    broker: Broker,
+    num_islands: int,
+    num_generations: int,
+    issues: typing.Optional[typing.List[int]],
+    max_steps: int,
+    target: float,
+    aggregate: typing.Callable[[typing.List[float]], float],
+    migration_interval: int,
+    num_migrants: int,
+    migration_timeout: typing.Optional[float],
+    seed: typing.Optional[int],
+) -> typing.Dict[str, typing.Any]:
+    """
+    Body of an island process: evolve the population of `make_island(island)` and migrate the best
+    `num_migrants` individuals to the next island (ring topology) every `migration_interval`
+    generations. Every island waits up to `migration_timeout` seconds for the migrants of the
+    previous island, so migration does not depend on which island is faster. Immigrants replace
+    the last individuals of the new population, which are never elites.
+    """
+    if seed is not None:
+        random.seed(seed + island)
+    population, env = make_island(island)
+    history = []
+    for generation in range(num_generations):
+        issue = issues[generation % len(issues)] if issues else None
+        rewards = population.evaluate(env, reward, issue=issue, max_steps=max_steps, target=target)
+        fitnesses = population.fitnesses(env, rewards, reward, max_steps, target, aggregate)
+        ranked = sorted(zip(population.individuals, fitnesses), key=lambda x: x[1], reverse=True)
+        history.append(dict(generation=generation, issue=issue, best=ranked[0][1]))
+        logger.info(f"Island {island}, generation {generation}: best fitness {ranked[0][1]}")
+        migrate = num_islands > 1 and (generation + 1) % migration_interval == 0
+        if migrate:
+            broker.send((island + 1) % num_islands, ranked[:num_migrants])
+        population.evolve(fitnesses)
+        if migrate:
+            migrants = broker.receive(island, expected=1, timeout=migration_timeout)
+            immigrants = [individual for individual, _ in migrants]
+            immigrants = immigrants[: len(population.individuals) - population.num_elite]
+            if immigrants:
+                population.individuals[-len(immigrants) :] = immigrants
+                logger.debug(f"Island {island} received {len(immigrants)} immigrants")
+    return dict(island=island, individuals=population.individuals, history=history)
+
+
+class IslandModel:
+    """
+    Runs `num_islands` populations in separate processes. Each process creates its own population,
+    sampler and environment with `make_island(island_id)` (and therefore its own host checkouts and
+    docker containers), so `make_island` and `reward` have to be picklable, i.e. module level
+    functions. Migration uses a `QueueBroker` by default, or a `FileBroker` to span several machines.
+    """
+
+    def __init__(
+        self,
+        make_island: IslandFactory,
+        num_islands: int = os.cpu_count() or 1,
+        reward: typing.Optional[typing.Callable[[api.State], float]] = None,
+        broker: typing.Optional[Broker] = None,
+        migration_interval: int = config.ISLAND_MIGRATION_INTERVAL,
+        num_migrants: int = config.ISLAND_NUM_MIGRANTS,
+        migration_timeout: typing.Optional[float] = config.ISLAND_MIGRATION_TIMEOUT_SECONDS,
+    ):
+        self.make_island = make_island
+        self.num_islands = num_islands
+        self.reward = reward or fitness.percent_successfull
+        self.broker = broker
+        self.migration_interval = migration_interval
+        self.num_migrants = num_migrants
+        self.migration_timeout = migration_timeout
+
+    def run(
+        self,
+        num_generations: int,
+        issues: typing.Optional[typing.List[int]] = None,
+        max_steps: int = 1,
+        target: float = 1.0,
+        aggregate: typing.Callable[[typing.List[float]], float] = max,
+        seed: typing.Optional[int] = None,
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+        """
+        Evolve all islands for `num_generations` generations. Generation `g` of every island uses
+        issue `issues[g % len(issues)]` (a random issue if `issues` is not given). `max_steps`,
+        `target` and `aggregate` are used like in `genetic.Population.run_generation`, so
+        `aggregate` has to be picklable too.
+
+        Returns:
+            List[dict]: Per island, the final `individuals` and the `history` of the best fitness.
+        """
+        context = multiprocessing.get_context("spawn")  # forking threads (e.g. docker) is unsafe
+        args = (
+            num_generations,
+            issues,
+            max_steps,
+            target,
+            aggregate,
+            self.migration_interval,
+            self.num_migrants,
+            self.migration_timeout,
+            seed,
+        )
+        if self.broker is not None:
+            return self._run_islands(context, self.broker, args)
+        with context.Manager() as manager:
+            return self._run_islands(context, QueueBroker(self.num_islands, manager=manager), args)
+
+    def _run_islands(self, context, broker: Broker, args: tuple) -> typing.List[typing.Dict]:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.num_islands, mp_context=context
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _run_island,
+                    island,
+                    self.make_island,
+                    self.reward,
+                    broker,
+                    self.num_islands,
+                    *args,
+                )
+                for island in range(self.num_islands)
+            ]
+            return [future.result() for future in futures]
@@ -1,14 +1,21 @@
 import os
 from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.components.retrievers import InMemoryEmbeddingRetriever, InMemoryBM25Retriever
+from haystack.components.retrievers import InMemoryBM25Retriever
 from haystack.components.converters.txt import TextFileToDocument
 import haystack
+import dataclasses
 import typing
 from pathlib import Path
 import logging
 import ast
+import hashlib
+import inspect
+import time
+import concurrent.futures
 from . import utils
 from . import config
+from . import embedding
+from . import tracing
 from .codemapretriever import CodeMapRetriever
 
 logger = logging.getLogger(__name__)
@@ -24,6 +31,57 @@ def file_path_formatter(p: str) -> str:
     return p
 
 
+def _normalize_path(p: typing.Union[str, Path]) -> str:
+    return os.path.normpath(str(p)).replace("\\", "/")
+
+
+class IndexedDocumentStore(InMemoryDocumentStore):
+    """
+    In-memory document store with a secondary index from the normalized (relative) file path of a
+    document to its IDs, so path based retrievers don't have to scan all documents.
+    """
+
+    PATH_KEYS = ("file_path_relative", "file_path")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._path_index: typing.Dict[str, typing.Dict[str, None]] = {}  # dict as ordered set
+
+    def _paths(self, doc: haystack.Document) -> typing.Set[str]:
+        return {_normalize_path(doc.meta[k]) for k in self.PATH_KEYS if doc.meta.get(k)}
+
+    def write_documents(self, documents: typing.List[haystack.Document], *args, **kwargs) -> int:
+        written = super().write_documents(documents, *args, **kwargs)
+        for doc in documents:
+            if self.storage.get(doc.id) is doc:
+                for path in self._paths(doc):
+                    self._path_index.setdefault(path, {})[doc.id] = None
+        return written
+
+    def delete_documents(self, document_ids: typing.List[str]) -> None:
+        for doc_id in document_ids:
+            doc = self.storage.get(doc_id)
+            if doc is None:
+                continue
+            for path in self._paths(doc):
+                ids = self._path_index.get(path, {})
+                ids.pop(doc_id, None)
+                if not ids:
+                    self._path_index.pop(path, None)
+        super().delete_documents(document_ids)
+
+    def get_documents_by_path(
+        self, paths: typing.Iterable[typing.Union[str, Path]]
+    ) -> typing.List[haystack.Document]:
+        """
+        Return the documents of the given file paths, in the order of the paths.
+        """
+        ids = {}
+        for path in paths:
+            ids.update(self._path_index.get(_normalize_path(path), {}))
+        return [self.storage[i] for i in ids]
+
+
 @haystack.component
 class PyFileConverter:
     @haystack.component.output_types(documents=typing.List[haystack.Document])
@@ -226,9 +284,10 @@ class PyASTConverter:
 
 @haystack.component
 class OracleRetriever:
-    def __init__(self, document_store: InMemoryDocumentStore, **kwargs):
+    def __init__(self, document_store: IndexedDocumentStore, **kwargs):
         self.document_store = document_store
         self._oracle_files = []
+        self.version = 0  # changes with the oracle files, part of the cache key of `Store`
         if kwargs:
             logger.warning(f"OracleRetriever received unknown kwargs: {kwargs}")
 
@@ -236,18 +295,11 @@ class OracleRetriever:
     def run(self, query: str):
         if not self._oracle_files:
             raise ValueError("Oracle files not set")
-        all_docs = self.document_store.filter_documents()
-        docs = []
-        for doc in all_docs:
-            if "file_path" in doc.meta:
-                fp = doc.meta["file_path"]
-                fp = os.path.normpath(fp)
-                if fp in self._oracle_files:
-                    docs.append(doc)
-        return {"documents": docs}
+        return {"documents": self.document_store.get_documents_by_path(self._oracle_files)}
 
     def set_oracle_files(self, files: typing.List[str]):
-        self._oracle_files = [os.path.normpath(f) for f in files]
+        self._oracle_files = [_normalize_path(f) for f in files]
+        self.version += 1
 
 
 @haystack.component
@@ -263,18 +315,126 @@ class FullCodeRetriever:
         return {"documents": all_docs}
 
 
+@haystack.component
+class HybridRetriever:
+    """
+    Runs BM25 and embedding retrieval in parallel and fuses both rankings, either with reciprocal
+    rank fusion or with a weighted sum of the min-max normalized scores.
+    """
+
+    RRF_K = 60
+
+    def __init__(
+        self,
+        document_store: InMemoryDocumentStore,
+        embedder: embedding.LocalEmbedder,
+        index: typing.Optional[embedding.EmbeddingIndex] = None,
+        top_k: int = config.RAG_TOP_N,
+        join_mode: typing.Literal["reciprocal_rank_fusion", "weighted"] = config.HYBRID_JOIN_MODE,
+        weights: typing.Optional[typing.Dict[str, float]] = None,
+    ):
+        self.document_store = document_store
+        self.top_k = top_k
+        self.join_mode = join_mode
+        self.weights = weights or config.HYBRID_WEIGHTS
+        self.bm25_retriever = InMemoryBM25Retriever(document_store=document_store)
+        self.embedding_retriever = embedding.EmbeddingRetriever(
+            document_store=document_store, embedder=embedder, index=index
+        )
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.timings = {}
+
+    def close(self):
+        """
+        Stop the threads running the two retrievers.
+        """
+        self._executor.shutdown(wait=False)
+
+    def __del__(self):
+        if hasattr(self, "_executor"):
+            self.close()
+
+    def _timed(self, name: str, func, **kwargs):
+        start = time.perf_counter()
+        docs = func(**kwargs)["documents"]
+        return name, docs, time.perf_counter() - start
+
+    @haystack.component.output_types(documents=typing.List[haystack.Document])
+    def run(self, query: str, top_k: typing.Optional[int] = None):
+        top_k = top_k or self.top_k
+        num_candidates = max(3 * top_k, 10)
+        futures = [
+            self._executor.submit(
+                self._timed, "bm25", self.bm25_retriever.run, query=query, top_k=num_candidates
+            ),
+            self._executor.submit(
+                self._timed,
+                "embedding",
+                self.embedding_retriever.run,
+                query=query,
+                top_k=num_candidates,
+            ),
+        ]
+        rankings = {}
+        timings = {}
+        for future in futures:
+            name, docs, duration = future.result()
+            rankings[name] = docs
+            timings[name] = duration
+        start = time.perf_counter()
+        docs = self._fuse(rankings)[:top_k]
+        timings["fusion"] = time.perf_counter() - start
+        self.timings = timings
+        logger.debug(f"Hybrid retrieval timings: {timings}")
+        return {"documents": docs}
+
+    def _fuse(
+        self, rankings: typing.Dict[str, typing.List[haystack.Document]]
+    ) -> typing.List[haystack.Document]:
+        scores = {}
+        documents = {}
+        for name, docs in rankings.items():
+            weight = self.weights.get(name, 1.0)
+            if self.join_mode == "reciprocal_rank_fusion":
+                contributions = [weight / (self.RRF_K + rank + 1) for rank in range(len(docs))]
+            elif self.join_mode == "weighted":
+                raw = [d.score or 0.0 for d in docs]
+                low, high = (min(raw), max(raw)) if raw else (0.0, 0.0)
+                if high > low:
+                    contributions = [weight * (r - low) / (high - low) for r in raw]
+                else:  # e.g. a single document, which is the best of its ranking
+                    contributions = [weight] * len(raw)
+            else:
+                raise NotImplementedError(f"Join mode {self.join_mode} not implemented")
+            for doc, contribution in zip(docs, contributions):
+                documents.setdefault(doc.id, doc)
+                scores[doc.id] = scores.get(doc.id, 0.0) + contribution
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [dataclasses.replace(documents[i], score=scores[i]) for i in ranked]
+
+
 class Store:
     def __init__(
         self,
         converter: typing.Literal["txt", "skeleton", "py", "ast"] = "txt",
-        retriever: typing.Literal["oracle", "bm25", "embedding", "full", "codemap"] = "bm25",
+        retriever: typing.Literal[
+            "oracle", "bm25", "embedding", "hybrid", "full", "codemap"
+        ] = "bm25",
         **kwargs,
     ):
-        self.document_store = InMemoryDocumentStore(
+        self.document_store = IndexedDocumentStore(
             embedding_similarity_function="dot_product", bm25_tokenization_regex=r"\b\w\w+\b"
         )
 
         self.path = None
+        self.embedder = None
+        self.index = None
+        self.timings = {}
+        self.version = 0
+        self._current_fingerprint = None
+        self._results: typing.Dict[
+            typing.Tuple[int, int, str, typing.Optional[int]], typing.List[haystack.Document]
+        ] = {}
 
         if converter == "txt":
             self.converter = TxtFileConverter()
@@ -292,8 +452,22 @@ class Store:
                 document_store=self.document_store, top_k=config.RAG_TOP_N
             )
         elif retriever == "embedding":
-            self.retriever = InMemoryEmbeddingRetriever(
-                document_store=self.document_store, top_k=config.RAG_TOP_N
+            self.embedder = embedding.LocalEmbedder(**kwargs)
+            self.index = embedding.EmbeddingIndex(dtype=config.EMBEDDING_INDEX_DTYPE)
+            self.retriever = embedding.EmbeddingRetriever(
+                document_store=self.document_store,
+                embedder=self.embedder,
+                index=self.index,
+                top_k=config.RAG_TOP_N,
+            )
+        elif retriever == "hybrid":
+            self.embedder = embedding.LocalEmbedder(**kwargs)
+            self.index = embedding.EmbeddingIndex(dtype=config.EMBEDDING_INDEX_DTYPE)
+            self.retriever = HybridRetriever(
+                document_store=self.document_store,
+                embedder=self.embedder,
+                index=self.index,
+                top_k=config.RAG_TOP_N,
             )
         elif retriever == "oracle":
             self.retriever = OracleRetriever(document_store=self.document_store)
@@ -304,15 +478,87 @@ class Store:
         else:
             raise NotImplementedError(f"Retriever {retriever} not implemented")
 
+    @staticmethod
+    def _fingerprint(path: Path, files: typing.List[Path]) -> str:
+        """
+        Hash of the path and the content of all files, used to detect if the store is up to date.
+        """
+        h = hashlib.sha256(str(path).encode())
+        for file in files:
+            h.update(str(file).encode())
+            with open(file, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    @tracing.traced("store.update")
     def update(self, state):
+        path = utils.str2path(state.path)
+        files = sorted(path.rglob("*.py"))
+        fingerprint = self._fingerprint(path, files)
+        if fingerprint == self._current_fingerprint:
+            logger.debug(f"Store is up to date with path {state.path}")
+            return
         logger.info(f"Updating store with path {state.path}")
+        timings = {}
+        start = time.perf_counter()
         if self.path is not None:  # Clear the store
             utils.clear_store(self.document_store)
-        self.path = utils.str2path(state.path)
-        files = list(self.path.rglob("*.py"))
+        self.path = path
         docs = self.converter.run(sources=files, base_path=state.path)["documents"]
+        timings["convert"] = time.perf_counter() - start
+        start = time.perf_counter()
         self.document_store.write_documents(docs, policy="overwrite")
+        timings["write"] = time.perf_counter() - start
+        if self.embedder is not None:
+            start = time.perf_counter()
+            vectors = self.embedder.embed([d.content or "" for d in docs])
+            self.index.build([d.id for d in docs], vectors)
+            timings["embed"] = time.perf_counter() - start
+        self.timings = timings
+        logger.debug(f"Store update timings: {timings}")
         if isinstance(self.retriever, CodeMapRetriever):
-            new_docs = self.retriever.get_summed_docs(self.document_store.filter_documents(), state)
+            new_docs = self.retriever.get_summed_docs(self.document_store.filter_documents())
             utils.clear_store(self.document_store)
             self.document_store.write_documents(new_docs, policy="overwrite")
+        self._current_fingerprint = fingerprint
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Start a new version of the store, e.g. after changing the retriever settings. Cached
+        retrieval results of older versions are discarded.
+        """
+        self.version += 1
+        self._results.clear()
+
+    @tracing.traced("store.retrieve")
+    def retrieve_many(
+        self, queries: typing.List[str], top_k: typing.Optional[int] = None
+    ) -> typing.List[typing.List[haystack.Document]]:
+        """
+        Retrieve documents for many queries. Results are cached per (store version, retriever
+        version, query, top_k), so identical queries (e.g. the same issue for every individual of a
+        population) only hit the retriever once until the store or the retriever changes (e.g.
+        `OracleRetriever.set_oracle_files`). `top_k` is ignored by retrievers without a `top_k`
+        (oracle, full and codemap), which return a fixed set of documents.
+        """
+        kwargs = {}
+        if top_k is not None and "top_k" in inspect.signature(self.retriever.run).parameters:
+            kwargs["top_k"] = top_k
+        version = (self.version, getattr(self.retriever, "version", 0))
+        missing = [q for q in dict.fromkeys(queries) if (*version, q, top_k) not in self._results]
+        tracing.current_span().set_tag("missing", len(missing))
+        if missing:
+            logger.debug(f"Retrieving {len(missing)} of {len(queries)} queries, rest is cached")
+            if isinstance(self.retriever, embedding.EmbeddingRetriever):
+                results = self.retriever.run_batch(missing, **kwargs)
+            else:
+                results = [self.retriever.run(query=q, **kwargs)["documents"] for q in missing]
+            for query, docs in zip(missing, results):
+                self._results[(*version, query, top_k)] = docs
+        return [self._results[(*version, q, top_k)] for q in queries]
+
+    def retrieve(
+        self, query: str, top_k: typing.Optional[int] = None
+    ) -> typing.List[haystack.Document]:
+        return self.retrieve_many([query], top_k=top_k)[0]
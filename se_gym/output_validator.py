@@ -4,6 +4,7 @@ import re
 import ast
 import pydantic
 import logging
+import time
 
 from . import runner_host
 
@@ -26,11 +27,18 @@ class OutputValidator:
         self,
     ):
         self.retry_counter = 0
+        self.seconds = 0.0
         self.code_base_root = None
         self.state = None
 
     def update_state(self, state):
+        """
+        Set the state for the next sampling. Also resets the number of validation attempts and the
+        time spent validating.
+        """
         self.state = state
+        self.retry_counter = 0
+        self.seconds = 0.0
 
     @haystack.component.output_types(
         valid_replies=typing.List[str],
@@ -43,6 +51,7 @@ class OutputValidator:
             logger.critical("State is not set")
             raise ValueError("State is not set")
         self.retry_counter += 1
+        start = time.perf_counter()
         try:
             rep0 = replies[0]
 
@@ -70,7 +79,6 @@ class OutputValidator:
                 f"Output {replies} (iteration {self.retry_counter}) is cleaned to {rep0_dict} and patched to {patch_str}"
             )
 
-            self.retry_counter = 0
             return {"valid_replies": [patch_str]}
 
         except Exception as e:
@@ -78,3 +86,5 @@ class OutputValidator:
                 f"Error in output validation (iteration {self.retry_counter}): {e}, model output was: {replies}"
             )
             return {"invalid_replies": replies, "error_message": str(e)}
+        finally:
+            self.seconds += time.perf_counter() - start
@@ -0,0 +1,168 @@
+"""
+Fit the retrieved documents and the test logs into the context window of the model.
+"""
+
+import logging
+import re
+import typing
+
+import haystack
+
+from . import config
+from . import testlog
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Tokenizer", "ContextPacker"]
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+class Tokenizer:
+    """
+    Count tokens locally. Uses `tiktoken` (extra `tokenizer`) if it is installed and the encoding is
+    available offline, otherwise falls back to a regex approximation (words, numbers and single
+    punctuation characters).
+    """
+
+    _APPROX = re.compile(r"\w+|[^\w\s]")
+
+    def __init__(self, encoding: str = config.TOKENIZER_ENCODING):
+        self._encoding = None
+        try:
+            import tiktoken  # delayed import to avoid slow startup
+
+            self._encoding = tiktoken.get_encoding(encoding)
+        except Exception:
+            logger.debug("tiktoken not available, approximating token counts", exc_info=True)
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(self._APPROX.findall(text))
+
+    def head(self, text: str, num_tokens: int) -> str:
+        """
+        The first `num_tokens` tokens of `text`.
+        """
+        if num_tokens <= 0:
+            return ""
+        if self._encoding is not None:
+            return self._encoding.decode(
+                self._encoding.encode(text, disallowed_special=())[:num_tokens]
+            )
+        for i, match in enumerate(self._APPROX.finditer(text)):
+            if i == num_tokens:
+                return text[: match.start()]
+        return text
+
+    def tail(self, text: str, num_tokens: int) -> str:
+        """
+        The last `num_tokens` tokens of `text`.
+        """
+        if num_tokens <= 0:
+            return ""
+        if self._encoding is not None:
+            return self._encoding.decode(
+                self._encoding.encode(text, disallowed_special=())[-num_tokens:]
+            )
+        starts = [m.start() for m in self._APPROX.finditer(text)]
+        if len(starts) <= num_tokens:
+            return text
+        return text[starts[-num_tokens] :]
+
+
+@haystack.component
+class ContextPacker:
+    """
+    Packs the documents and logs for the prompt into a token budget. Documents are kept in the order
+    of the retriever, the first document that does not fit is truncated, the rest is dropped. Logs
+    may use up to `log_fraction` of the budget, the newest logs are packed first. Each test log is
+    rendered as the changes since the previous log and its failures (see `testlog.TestLog`), with the
+    tail of each failure message. What was dropped is reported in `self.report`.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = config.PROMPT_TOKEN_BUDGET,
+        log_fraction: float = config.PROMPT_LOG_FRACTION,
+        message_tokens: int = config.LOG_MESSAGE_TAIL_TOKENS,
+        tokenizer: typing.Optional[Tokenizer] = None,
+    ):
+        self.token_budget = token_budget
+        self.log_fraction = log_fraction
+        self.message_tokens = message_tokens
+        self.tokenizer = tokenizer or Tokenizer()
+        self.report = {}
+
+    def _truncate_message(self, message: str) -> str:
+        tail = self.tokenizer.tail(message, self.message_tokens)
+        return tail if len(tail) == len(message) else "[...]" + tail
+
+    def _pack_logs(self, logs: typing.List, budget: int) -> typing.Tuple[typing.List[str], int]:
+        packed, used, dropped_entries, dropped_tokens = [], 0, 0, 0
+        logs = [testlog.TestLog.from_results(log) if isinstance(log, dict) else log for log in logs]
+        for i in range(len(logs) - 1, -1, -1):
+            log, previous = logs[i], logs[i - 1] if i > 0 else None
+            if isinstance(log, testlog.TestLog):
+                entries = log.render_entries(
+                    previous=previous if isinstance(previous, testlog.TestLog) else None,
+                    truncate=self._truncate_message,
+                )
+            else:
+                entries = [self._truncate_message(str(log))]
+            kept = []
+            for entry in entries:
+                tokens = self.tokenizer.count(entry)
+                if used + tokens <= budget:
+                    kept.append(entry)
+                    used += tokens
+                else:
+                    dropped_entries += 1
+                    dropped_tokens += tokens
+            if kept:
+                packed.append("\n".join(kept))
+        self.report.update(log_entries_dropped=dropped_entries, log_tokens_dropped=dropped_tokens)
+        return packed[::-1], used
+
+    def _pack_documents(
+        self, documents: typing.List[haystack.Document], budget: int
+    ) -> typing.List[haystack.Document]:
+        packed, used, truncated, dropped_tokens = [], 0, 0, 0
+        marker_tokens = self.tokenizer.count(TRUNCATION_MARKER)
+        for doc in documents:
+            content = doc.content or ""
+            tokens = self.tokenizer.count(content)
+            if used + tokens <= budget:
+                packed.append(doc)
+                used += tokens
+            elif budget - used > marker_tokens and truncated == 0:
+                head = self.tokenizer.head(content, budget - used - marker_tokens)
+                packed.append(haystack.Document(content=head + TRUNCATION_MARKER, meta=doc.meta))
+                used = budget
+                truncated += 1
+                dropped_tokens += tokens - self.tokenizer.count(head)
+            else:
+                dropped_tokens += tokens
+        self.report.update(
+            documents_total=len(documents),
+            documents_kept=len(packed),
+            documents_truncated=truncated,
+            document_tokens_used=used,
+            document_tokens_dropped=dropped_tokens,
+        )
+        return packed
+
+    @haystack.component.output_types(
+        documents=typing.List[haystack.Document], logs=typing.List[str]
+    )
+    def run(
+        self, documents: typing.List[haystack.Document], logs: typing.Optional[typing.List] = None
+    ):
+        self.report = {}
+        log_budget = int(self.token_budget * self.log_fraction)
+        logs, log_tokens = self._pack_logs(list(logs or []), log_budget)
+        documents = self._pack_documents(documents, self.token_budget - log_tokens)
+        if self.report["log_tokens_dropped"] or self.report["document_tokens_dropped"]:
+            logger.info(f"Context packing dropped content: {self.report}")
+        return {"documents": documents, "logs": logs}
@@ -3,7 +3,6 @@ import docker
 import tempfile
 import logging
 import docker.errors
-import sys
 import stat
 import os
 import shutil
@@ -11,8 +10,11 @@ import io
 import subprocess
 import xml.etree.ElementTree as ET
 import typing
+from . import runner_host
+from . import tracing
 from . import utils
 import tarfile
+import uuid
 
 __all__ = ["DockerConnector"]
 
@@ -23,60 +25,25 @@ class MalformedPatchException(Exception):
     pass
 
 
-def _parse_pytest_xml(tree: ET.Element) -> dict:
+class DockerConnector:
     """
-    Parse the XML tree of a pytest test result.
-
-    Args:
-        tree (ET.Element): The XML tree of the test results.
-
-    Returns:
-        dict: A dictionary containing the test results. The keys are the test names and the values are dictionaries containing the status and the message of the test, if it failed or errored.
+    Runs every job in a fresh child container of an image per repository and commit. Implements
+    `api.Runner`.
     """
-    test_results = {}
-    for testcase in tree.iter("testcase"):
-        test_name = testcase.get("classname") + "." + testcase.get("name")
-        test_results[test_name] = {}
-        if testcase.find("failure") is not None:
-            test_results[test_name]["status"] = "failed"
-            test_results[test_name]["message"] = testcase.find("failure").text
-        elif testcase.find("error") is not None:
-            test_results[test_name]["status"] = "error"
-            test_results[test_name]["message"] = testcase.find("error").text
-        elif testcase.find("skipped") is not None:
-            test_results[test_name]["status"] = "skipped"
-            test_results[test_name]["message"] = testcase.find("skipped").text
-        else:
-            test_results[test_name]["status"] = "passed"
-    return test_results
-
 
-class DockerConnector:
     def __init__(self):
         try:
             self.client = docker.from_env()
-        except docker.errors.DockerException:
-            print("Docker is not running")
+        except docker.errors.DockerException as e:
             logger.critical("Docker is not running")
-            sys.exit(1)
+            raise RuntimeError(
+                "Docker is not running, start it or use the local runner (config.RUNNER = 'local')"
+            ) from e
 
     @staticmethod
     def _create_dockerfile(temp_dir: str, repo: str, environment_setup_commit: str) -> str:
-        all_files = [f for f in os.listdir(os.path.join(temp_dir, "repo"))]
-        if "dev-requirements.txt" in all_files:
-            install_command = ["RUN pip install -r dev-requirements.txt"]
-        elif "requirements.txt" in all_files:
-            install_command = ["RUN pip install -r requirements.txt"]
-        elif "poetry.lock" in all_files:
-            install_command = ["RUN pip install poetry", "RUN poetry install"]
-        elif "Pipfile" in all_files:
-            install_command = ["RUN pip install pipenv", "RUN pipenv install"]
-        elif "setup.py" in all_files:
-            install_command = ["RUN pip install . -e"]
-        else:
-            logger.warning("No requirements file found. Skipping requirements installation.")
-            install_command = []
-        install_commands = "\n".join(install_command)
+        install_command = runner_host.install_commands(os.path.join(temp_dir, "repo"))
+        install_commands = "\n".join(f"RUN {c}" for c in install_command)
         dockerfile_str = f"""
 FROM python:3.12-alpine
 RUN apk add --no-cache git nano
@@ -88,6 +55,7 @@ RUN pip install pytest
 """
         return dockerfile_str
 
+    @tracing.traced("docker.build_image")
     def build_image(self, repo: str, environment_setup_commit: str, tag: str):
         """
         Build a docker image for the given repo and commit. First, clone the repo, checkout the commit, and search for a requirements.txt, pipfile, pyproject.toml or poetry.lock file. Then, create a Dockerfile that does the cloning, checkout, and installs the dependencies.
@@ -118,6 +86,7 @@ RUN pip install pytest
         except Exception:
             shutil.rmtree(temp_dir)
 
+    @tracing.traced("docker.get_base_container")
     def get_base_container(self, repo: str, environment_setup_commit: str):
         """
         Returns the tag of the base container for the given repo and commit.
@@ -132,14 +101,27 @@ RUN pip install pytest
             self.build_image(repo, environment_setup_commit, tag)
         return tag
 
+    @tracing.traced("docker.get_child_container")
     def get_child_container(self, repo: str, environment_setup_commit: str):
         tag = self.get_base_container(repo, environment_setup_commit)
         container = self.client.containers.run(
-            tag, detach=True, name=f"se_gym_container_{time.time()}_child{tag}", tty=True
+            tag,
+            detach=True,
+            name=f"se_gym_container_{time.time()}_{uuid.uuid4().hex[:8]}_child{tag}",
+            tty=True,
         )
         return container
 
+    def start(self, repo: str, environment_setup_commit: str):
+        return self.get_child_container(repo, environment_setup_commit)
+
+    @staticmethod
+    @tracing.traced("docker.kill")
+    def stop(container: docker.models.containers.Container):
+        container.kill()
+
     @staticmethod
+    @tracing.traced("docker.apply_patch")
     def apply_patch(container: docker.models.containers.Container, patch: str):
         if patch in [None, "", "[]"]:
             logger.info("No patch to apply")
@@ -162,6 +144,7 @@ RUN pip install pytest
         return apply_log
 
     @staticmethod
+    @tracing.traced("docker.run_tests")
     def run_tests(
         container: docker.models.containers.Container,
         suite: typing.Literal["pytest"] = "pytest",
@@ -172,7 +155,7 @@ RUN pip install pytest
             test_xml = container.exec_run("cat testresults.xml", workdir="/repo")
             xml_str = test_xml.output.decode("utf-8")
             tree = ET.fromstring(xml_str)
-            result = _parse_pytest_xml(tree)
+            result = runner_host.parse_pytest_xml(tree)
             return result
         else:
             raise NotImplementedError(f"Suite {suite} not implemented")
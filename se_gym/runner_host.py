@@ -3,13 +3,21 @@ import logging
 import tempfile
 import subprocess
 import os
-from fuzzywuzzy import fuzz
-import regex
+import xml.etree.ElementTree as ET
 
 from . import config
+from . import tracing
 from . import utils
 
-__all__ = ["generate_patch", "find_file", "MalformedPatchException"]
+__all__ = [
+    "generate_patch",
+    "run_command",
+    "find_file",
+    "build_module_index",
+    "install_commands",
+    "parse_pytest_xml",
+    "MalformedPatchException",
+]
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +26,14 @@ class MalformedPatchException(Exception):
     pass
 
 
+def run_command(args: typing.List[str], **kwargs) -> subprocess.CompletedProcess:
+    """
+    `subprocess.run`, traced as a span named after the command, e.g. `git apply`.
+    """
+    with tracing.span(" ".join(args[:2]), "subprocess", cwd=kwargs.get("cwd")):
+        return subprocess.run(args, **kwargs)
+
+
 class HostEnv:
     _environments = dict()
 
@@ -31,13 +47,14 @@ class HostEnv:
     @staticmethod
     def cleanup_environment(repo: str, commit: str):
         temp_dir = HostEnv.get_environment(repo, commit)
-        subprocess.run(["git", "reset", "--hard", commit], cwd=f"{temp_dir}/repo")
+        run_command(["git", "reset", "--hard", commit], cwd=f"{temp_dir}/repo")
 
     @staticmethod
     def _setup_environment(repo: str, commit: str):
         temp_dir = tempfile.mkdtemp(prefix=f"se_gym_{utils.slugify(repo)}_{utils.slugify(commit)}_")
-        subprocess.run(["git", "clone", f"https://github.com/{repo}.git", "repo"], cwd=temp_dir)
-        subprocess.run(["git", "reset", "--hard", commit], cwd=f"{temp_dir}/repo")
+        url = config.GIT_URL_TEMPLATE.format(repo=repo)
+        run_command(["git", "clone", url, "repo"], cwd=temp_dir)
+        run_command(["git", "reset", "--hard", commit], cwd=f"{temp_dir}/repo")
         return temp_dir
 
 
@@ -55,10 +72,80 @@ def find_file(root_dir: str, filepath: str) -> str:
     raise FileNotFoundError(f"File {filepath} not found")
 
 
+def build_module_index(root_dir: str) -> typing.Dict[str, str]:
+    """
+    Index all Python files in a directory by every suffix of their path, e.g. `a/b/c.py` is
+    reachable as `c.py`, `b/c.py` and `a/b/c.py`. Values are paths relative to `root_dir`. If two
+    files share a suffix, the first one in walk order wins, like in `find_file`.
+    """
+    index = {}
+    for dirpath, _, filenames in os.walk(root_dir):
+        for file in filenames:
+            if not file.endswith(".py"):
+                continue
+            relative = os.path.relpath(os.path.join(dirpath, file), root_dir).replace("\\", "/")
+            parts = relative.split("/")
+            for i in range(len(parts)):
+                index.setdefault("/".join(parts[i:]), relative)
+    return index
+
+
+def install_commands(root_dir: str, project: bool = True) -> typing.List[str]:
+    """
+    Shell commands installing the dependencies of the repository in `root_dir`, detected from its
+    requirements, lock or setup files. Without `project`, the repository itself is not installed,
+    which leaves nothing to run for repositories that only have a `setup.py`.
+    """
+    all_files = os.listdir(root_dir)
+    if "dev-requirements.txt" in all_files:
+        return ["pip install -r dev-requirements.txt"]
+    elif "requirements.txt" in all_files:
+        return ["pip install -r requirements.txt"]
+    elif "poetry.lock" in all_files:
+        return ["pip install poetry", "poetry install" if project else "poetry install --no-root"]
+    elif "Pipfile" in all_files:
+        return ["pip install pipenv", "pipenv install"]
+    elif "setup.py" in all_files:
+        return ["pip install -e ."] if project else []
+    logger.warning("No requirements file found. Skipping requirements installation.")
+    return []
+
+
+def parse_pytest_xml(tree: ET.Element) -> dict:
+    """
+    Parse the XML tree of a pytest test result.
+
+    Args:
+        tree (ET.Element): The XML tree of the test results.
+
+    Returns:
+        dict: A dictionary containing the test results. The keys are the test names and the values are dictionaries containing the status and the message of the test, if it failed or errored.
+    """
+    test_results = {}
+    for testcase in tree.iter("testcase"):
+        test_name = testcase.get("classname") + "." + testcase.get("name")
+        test_results[test_name] = {}
+        if testcase.find("failure") is not None:
+            test_results[test_name]["status"] = "failed"
+            test_results[test_name]["message"] = testcase.find("failure").text
+        elif testcase.find("error") is not None:
+            test_results[test_name]["status"] = "error"
+            test_results[test_name]["message"] = testcase.find("error").text
+        elif testcase.find("skipped") is not None:
+            test_results[test_name]["status"] = "skipped"
+            test_results[test_name]["message"] = testcase.find("skipped").text
+        else:
+            test_results[test_name]["status"] = "passed"
+    return test_results
+
+
 def get_code_span(full_code: str, partial_code: str) -> str:
     """
     Get the span of the code in the full code.
     """
+    import regex  # delayed import to avoid slow startup
+    from fuzzywuzzy import fuzz  # delayed import to avoid slow startup
+
     ids_max = str(int(len(partial_code) * config.FUZZY_MATCH_THRESHOLD / 100))
     err = (
         "Old code not found in the file, make sure old_code is exactly the same as in the codebase"
@@ -81,6 +168,7 @@ def get_code_span(full_code: str, partial_code: str) -> str:
     return match.span()
 
 
+@tracing.traced("apply_past_patches")
 def apply_past_patches(
     repo: str,
     environment_setup_commit: str,
@@ -90,10 +178,11 @@ def apply_past_patches(
     for patch in past_patches:
         with open(f"{temp_dir}/file.patch", "w") as f:
             f.write(patch)
-        subprocess.run(["git", "apply", "./../file.patch"], cwd=f"{temp_dir}/repo")
+        run_command(["git", "apply", "./../file.patch"], cwd=f"{temp_dir}/repo")
     return temp_dir
 
 
+@tracing.traced("generate_patch")
 def generate_patch(
     repo: str,
     environment_setup_commit: str,
@@ -113,7 +202,7 @@ def generate_patch(
     new_file_content = old_file_content[: span[0]] + new_code + old_file_content[span[1] :]
     with open(f"{temp_dir}/repo/{target_file}", "w") as f:
         f.write(new_file_content)
-    patch = subprocess.run(["git", "diff"], cwd=f"{temp_dir}/repo", capture_output=True)
+    patch = run_command(["git", "diff"], cwd=f"{temp_dir}/repo", capture_output=True)
     if patch.returncode != 0:
         raise MalformedPatchException("Could not generate patch")
     HostEnv.cleanup_environment(repo, environment_setup_commit)
@@ -0,0 +1,313 @@
+"""
+Lightweight runner that tests patches on the host instead of in docker containers, for fast
+experiments on small datasets (e.g. the dummy datasets). Only use it with code you trust: the
+sandbox limits resources, but does not isolate the file system or the network.
+"""
+
+import dataclasses
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import typing
+import uuid
+import xml.etree.ElementTree as ET
+
+from . import config
+from . import runner_host
+from . import tracing
+from . import utils
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__all__ = ["LocalRunner", "LocalJob"]
+
+logger = logging.getLogger(__name__)
+
+_READY = ".se_gym_ready"  # marks a completely built shared virtualenv
+
+# Sets the resource limits and replaces itself with the test command. Used instead of `preexec_fn`,
+# which is not safe while other threads are running.
+_LIMITS_WRAPPER = """
+import os, resource, sys
+for limit, value in ((resource.RLIMIT_AS, sys.argv[1]), (resource.RLIMIT_CPU, sys.argv[2])):
+    if value != "None":
+        resource.setrlimit(limit, (int(value), int(value)))
+os.execv(sys.argv[3], sys.argv[3:])
+"""
+
+
+@dataclasses.dataclass
+class LocalJob:
+    """
+    Sandbox of one job: a git worktree of the repository and a virtualenv.
+    """
+
+    path: str  # directory of the job, removed by `LocalRunner.stop`
+    repo_dir: str  # host checkout the worktree belongs to
+    worktree: str
+    venv: str
+
+
+def _bin(venv: str, name: str) -> str:
+    return os.path.join(venv, "Scripts" if os.name == "nt" else "bin", name)
+
+
+def _link(src: str, dst: str):
+    """
+    Hardlink a file, or copy it if linking is not possible (e.g. across file systems).
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class LocalRunner:
+    """
+    Runs every job in a sandbox on the host. Implements `api.Runner`.
+
+    - The repository is checked out as a `git worktree` of the host checkout, which shares the git
+      objects, so starting a job does not clone anything.
+    - One virtualenv per repository and commit is built once with the dependencies of the
+      repository (detected like for the docker image) and cached in `config.CACHE_DIR`. The
+      repository itself is not installed: the job's worktree (and its `src` directory) comes first on
+      `PYTHONPATH`, so the tests import the patched code. Depending on `venv_mode`, every job gets a
+      copy of it made of hardlinks (`"link"`), a full copy (`"copy"`) or uses it directly
+      (`"shared"`, fastest, but tests can modify the shared environment).
+    - Tests run as a subprocess in a new session with a timeout and, on POSIX, limits on memory and
+      CPU time, set by a small wrapper that `exec`s the tests.
+    """
+
+    def __init__(
+        self,
+        directory: typing.Optional[str] = None,
+        venv_mode: typing.Literal["link", "copy", "shared"] = config.LOCAL_VENV_MODE,
+        system_site_packages: bool = config.LOCAL_SYSTEM_SITE_PACKAGES,
+        timeout: typing.Optional[float] = config.TIMEOUT_SECONDS,
+        memory_limit: typing.Optional[int] = config.LOCAL_MEMORY_LIMIT_BYTES,
+        cpu_limit: typing.Optional[int] = config.LOCAL_CPU_LIMIT_SECONDS,
+    ):
+        self.directory = directory or tempfile.mkdtemp(prefix="se_gym_local_")
+        os.makedirs(self.directory, exist_ok=True)
+        self.venv_mode = venv_mode
+        self.system_site_packages = system_site_packages
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self._venvs: typing.Dict[typing.Tuple[str, str], str] = {}
+        self._locks: typing.Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, key: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _env(self, venv: str, worktree: typing.Optional[str] = None) -> typing.Dict[str, str]:
+        env = dict(os.environ, VIRTUAL_ENV=venv, PYTHONDONTWRITEBYTECODE="1")
+        env["PATH"] = os.path.dirname(_bin(venv, "python")) + os.pathsep + env.get("PATH", "")
+        env.pop("PYTHONHOME", None)
+        if worktree is not None:
+            paths = [os.path.join(worktree, "src"), worktree]
+            paths = [p for p in paths if os.path.isdir(p)]
+            env["PYTHONPATH"] = os.pathsep.join(paths + [env.get("PYTHONPATH", "")]).rstrip(
+                os.pathsep
+            )
+        return env
+
+    def _install_setup_dependencies(self, repo_dir: str, venv: str):
+        """
+        Install the dependencies declared in `setup.py`, but not the repository itself: resolve the
+        installation with pip's report and install everything except the requested project.
+        """
+        python = _bin(venv, "python")
+        report = os.path.join(venv, "install-report.json")
+        result = subprocess.run(
+            [python, "-m", "pip", "install", "--dry-run", "--quiet", "--report", report, "."],
+            cwd=repo_dir,
+            env=self._env(venv),
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            logger.warning(
+                f"Resolving the dependencies of {repo_dir} failed: {result.stderr[-2000:]}"
+            )
+            return
+        with open(report, "r") as f:
+            items = json.load(f).get("install", [])
+        dependencies = [
+            f"{i['metadata']['name']}=={i['metadata']['version']}"
+            for i in items
+            if not i.get("requested")
+        ]
+        if dependencies:
+            subprocess.run(
+                [python, "-m", "pip", "install", *dependencies],
+                env=self._env(venv),
+                capture_output=True,
+            )
+
+    @tracing.traced("local.build_venv")
+    def _build_venv(self, repo_dir: str, venv: str):
+        logger.info(f"Building virtualenv {venv} for {repo_dir}")
+        temp = f"{venv}.{uuid.uuid4().hex[:8]}.tmp"
+        command = [sys.executable, "-m", "venv", temp]
+        if self.system_site_packages:
+            command.insert(3, "--system-site-packages")
+        subprocess.run(command, check=True, capture_output=True)
+        commands = runner_host.install_commands(repo_dir, project=False)
+        if not commands and os.path.exists(os.path.join(repo_dir, "setup.py")):
+            self._install_setup_dependencies(repo_dir, temp)
+        for install in commands + ["pip install pytest"]:
+            result = subprocess.run(
+                install, shell=True, cwd=repo_dir, env=self._env(temp), capture_output=True
+            )
+            if result.returncode != 0:
+                logger.warning(f"`{install}` failed in {venv}: {result.stderr.decode()[-2000:]}")
+        open(os.path.join(temp, _READY), "w").close()
+        try:
+            os.replace(temp, venv)
+        except OSError:  # built by another process meanwhile
+            shutil.rmtree(temp, ignore_errors=True)
+
+    def get_venv(self, repo: str, environment_setup_commit: str) -> str:
+        """
+        The shared virtualenv of the repository at the commit, built on first use.
+        """
+        key = (repo, environment_setup_commit)
+        if key not in self._venvs:
+            with self._lock(f"venv:{key}"):
+                if key not in self._venvs:
+                    root = config.CACHE_DIR or self.directory
+                    name = f"{utils.slugify(repo)}_{utils.slugify(environment_setup_commit)}"
+                    tag = f"py{sys.version_info.major}{sys.version_info.minor}"
+                    venv = os.path.abspath(os.path.join(root, "venvs", f"{name}_{tag}"))
+                    if not os.path.exists(os.path.join(venv, _READY)):
+                        shutil.rmtree(venv, ignore_errors=True)  # from an interrupted build
+                        os.makedirs(os.path.dirname(venv), exist_ok=True)
+                        repo_dir = runner_host.HostEnv.get_environment(
+                            repo, environment_setup_commit
+                        )
+                        self._build_venv(os.path.join(repo_dir, "repo"), venv)
+                    self._venvs[key] = venv
+        return self._venvs[key]
+
+    @tracing.traced("local.start")
+    def start(self, repo: str, environment_setup_commit: str) -> LocalJob:
+        """
+        Create the sandbox of a new job.
+        """
+        venv = self.get_venv(repo, environment_setup_commit)
+        repo_dir = os.path.join(
+            runner_host.HostEnv.get_environment(repo, environment_setup_commit), "repo"
+        )
+        path = tempfile.mkdtemp(prefix="job_", dir=self.directory)
+        job = LocalJob(path=path, repo_dir=repo_dir, worktree=os.path.join(path, "repo"), venv=venv)
+        try:
+            with self._lock(f"git:{repo_dir}"):  # git locks the worktree list
+                result = runner_host.run_command(
+                    ["git", "worktree", "add", "--detach", job.worktree, environment_setup_commit],
+                    cwd=repo_dir,
+                    capture_output=True,
+                )
+            if result.returncode != 0:
+                raise RuntimeError(
+                    f"Could not check out {repo} at {environment_setup_commit}: "
+                    f"{result.stderr.decode('utf-8')}"
+                )
+            if self.venv_mode != "shared":
+                job.venv = os.path.join(path, "venv")
+                copy = _link if self.venv_mode == "link" else shutil.copy2
+                with tracing.span("local.copy_venv", mode=self.venv_mode):
+                    shutil.copytree(
+                        venv,
+                        job.venv,
+                        symlinks=True,
+                        copy_function=copy,
+                        ignore=shutil.ignore_patterns("__pycache__"),
+                    )
+        except BaseException:
+            self.stop(job)
+            raise
+        return job
+
+    @staticmethod
+    @tracing.traced("local.apply_patch")
+    def apply_patch(job: LocalJob, patch: str):
+        if patch in [None, "", "[]"]:
+            logger.info("No patch to apply")
+            return ""
+        patch_file = os.path.join(job.path, "file.patch")
+        with open(patch_file, "w") as f:
+            f.write(patch)
+        result = runner_host.run_command(
+            [
+                "git",
+                "apply",
+                patch_file,
+                "--ignore-space-change",
+                "--ignore-whitespace",
+                "--verbose",
+                "--recount",
+                "--inaccurate-eof",
+            ],
+            cwd=job.worktree,
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            err = f"Failed to apply patch {patch}, error {result.stderr.decode('utf-8')}"
+            logger.info(err)
+            raise runner_host.MalformedPatchException(err)
+        return result
+
+    @tracing.traced("local.run_tests")
+    def run_tests(self, job: LocalJob, suite: typing.Literal["pytest"] = "pytest") -> dict:
+        if suite != "pytest":
+            raise NotImplementedError(f"Suite {suite} not implemented")
+        report = os.path.join(job.path, "testresults.xml")
+        command = [_bin(job.venv, "python"), "-m", "pytest", f"--junitxml={report}"]
+        command += ["-p", "no:cacheprovider"]
+        if resource is not None and (self.memory_limit, self.cpu_limit) != (None, None):
+            limits = [str(self.memory_limit), str(self.cpu_limit)]
+            command = [sys.executable, "-I", "-c", _LIMITS_WRAPPER, *limits, *command]
+        process = subprocess.Popen(
+            command,
+            cwd=job.worktree,
+            env=self._env(job.venv, job.worktree),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,  # to kill all processes started by the tests on timeout
+        )
+        try:
+            process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            logger.info(f"Tests of {job.worktree} timed out after {self.timeout} seconds")
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            process.wait()
+        if not os.path.exists(report):
+            return {}
+        return runner_host.parse_pytest_xml(ET.parse(report).getroot())
+
+    @tracing.traced("local.stop")
+    def stop(self, job: LocalJob):
+        """
+        Remove the sandbox of the job.
+        """
+        with self._lock(f"git:{job.repo_dir}"):
+            runner_host.run_command(
+                ["git", "worktree", "remove", "--force", job.worktree],
+                cwd=job.repo_dir,
+                capture_output=True,
+            )
+        shutil.rmtree(job.path, ignore_errors=True)
@@ -1,14 +1,20 @@
+import hashlib
+import json
 import logging
+import time
 import typing
 from haystack.components.builders import PromptBuilder
 import haystack
 import pydantic
 
+from . import api
 from . import observe
 from . import config
 from . import generators
 from . import output_validator
+from . import packing
 from . import runner_host
+from . import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -87,45 +93,88 @@ EXAMPLE: If you want to replace the code in the file `./src/main.py` from `Hello
         self.store = store
 
         self.prompt_builder = PromptBuilder(template=self.PROMPT_TEMPLATE)
+        self.packer = packing.ContextPacker()
         self.validator = output_validator.OutputValidator()
+        self.generator = generators.CustomGenerator(
+            model_config=config.MODEL_CONFIG, no_verify=True, schema=Patch
+        )
+        self.last_stats = dict(timings={}, retries=0, usage={})
         self.pipeline = haystack.Pipeline(max_loops_allowed=config.MAX_RETRIES)
 
         self.pipeline.add_component(instance=self.prompt_builder, name="prompt_builder")
-        self.pipeline.add_component(instance=self.store.retriever, name="retriever")
-        self.pipeline.add_component(
-            instance=generators.CustomGenerator(
-                model_config=config.MODEL_CONFIG, no_verify=True, schema=Patch
-            ),
-            name="generator",
-        )
+        self.pipeline.add_component(instance=self.generator, name="generator")
         self.pipeline.add_component(instance=self.validator, name="validator")
 
-        self.pipeline.connect("retriever.documents", "prompt_builder.documents")
         self.pipeline.connect("prompt_builder", "generator")
         self.pipeline.connect("generator", "validator")
         self.pipeline.connect("validator.invalid_replies", "prompt_builder.invalid_replies")
         self.pipeline.connect("validator.error_message", "prompt_builder.error_message")
 
+    def config_hash(self) -> str:
+        """
+        Hash of the configuration that influences the sampled patches besides the prompt, used in the
+        keys of `archive.FitnessArchive`.
+        """
+        settings = dict(
+            model=config.MODEL_CONFIG.get("model_name"),
+            base_url=config.MODEL_CONFIG.get("base_url"),
+            template=self.PROMPT_TEMPLATE,
+            converter=type(self.store.converter).__name__,
+            converter_kind=getattr(self.store.converter, "kind", None),
+            retriever=type(self.store.retriever).__name__,
+            token_budget=self.packer.token_budget,
+            max_retries=config.MAX_RETRIES,
+        )
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
     def update_current_state(self, state):
         self.code_base_root = state.path
         runner_host.apply_past_patches(state.repo, state.setup_commit, state.previous_patches)
         self.store.update(state=state)
         self.validator.update_state(state)
 
+    @tracing.traced("sampler")
     def __call__(
         self,
         trainable_prompt: str,
         state,
-    ) -> str:
-        self.update_current_state(state)
-        pipeline_res = self.pipeline.run(
-            data={
-                "prompt_builder": {
-                    "trainable_prompt": trainable_prompt,
-                    "issue_description": state.issue,
-                    "logs": state.logs,
-                },
-                "retriever": {"query": state.issue},
+    ) -> api.Action:
+        """
+        Sample a patch for the state. The returned `api.Action` carries the time spent per stage, the
+        number of retries of the validator and the token usage. They are also kept in
+        `self.last_stats`, so they are available if sampling fails.
+        """
+        timings = {}
+        self.generator.reset_stats()
+        self.last_stats = dict(timings=timings, retries=0, usage={})
+        try:
+            start = time.perf_counter()
+            with tracing.span("sampler.update"):
+                self.update_current_state(state)
+            timings["update"] = time.perf_counter() - start
+            start = time.perf_counter()
+            with tracing.span("sampler.retrieval"):
+                documents = self.store.retrieve(state.issue)  # cached until the store changes
+            timings["retrieval"] = time.perf_counter() - start
+            start = time.perf_counter()
+            with tracing.span("sampler.packing"):
+                packed = self.packer.run(documents=documents, logs=state.logs)
+            timings["packing"] = time.perf_counter() - start
+            pipeline_res = self.pipeline.run(
+                data={
+                    "prompt_builder": {
+                        "trainable_prompt": trainable_prompt,
+                        "documents": packed["documents"],
+                        "issue_description": state.issue,
+                        "logs": packed["logs"],
+                    },
+                }
+            )
+        finally:
+            timings["generation"] = self.generator.stats["seconds"]
+            timings["validation"] = self.validator.seconds
+            self.last_stats["retries"] = max(self.validator.retry_counter - 1, 0)
+            self.last_stats["usage"] = {
+                k: self.generator.stats[k] for k in ("prompt_tokens", "completion_tokens")
             }
-        )
-        return pipeline_res["validator"]["valid_replies"][0]
+        return api.Action(pipeline_res["validator"]["valid_replies"][0], **self.last_stats)
@@ -0,0 +1,161 @@
+"""
+Compact, columnar storage of test results, as produced by `runner_host.parse_pytest_xml`.
+"""
+
+import collections.abc
+import logging
+import typing
+
+import numpy as np
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["TestLog"]
+
+STATUSES = ("passed", "failed", "error", "skipped")
+STATUS_CODES = {s: i for i, s in enumerate(STATUSES)}
+FAILING = (STATUS_CODES["failed"], STATUS_CODES["error"])
+
+
+class TestLog(collections.abc.Mapping):
+    """
+    Test results of one run. Test ids are stored once (and shared with the previous run if they did
+    not change), statuses as an int8 array and failure messages de-duplicated and truncated to
+    their last `config.LOG_MESSAGE_MAX_CHARS` characters.
+
+    The log behaves like the dictionary returned by the test parser, i.e.
+    `log[test_id] == {"status": "failed", "message": "..."}`.
+    """
+
+    __test__ = False  # not a pytest test class
+    __slots__ = ("test_ids", "status", "message_ids", "messages", "_positions")
+
+    def __init__(
+        self,
+        test_ids: typing.Tuple[str, ...],
+        status: np.ndarray,
+        message_ids: np.ndarray,
+        messages: typing.Tuple[str, ...],
+    ):
+        self.test_ids = test_ids
+        self.status = status
+        self.message_ids = message_ids
+        self.messages = messages
+        self._positions = None
+
+    @classmethod
+    def from_results(
+        cls,
+        results: typing.Dict[str, typing.Dict[str, str]],
+        previous: typing.Optional["TestLog"] = None,
+        max_message_chars: int = config.LOG_MESSAGE_MAX_CHARS,
+    ) -> "TestLog":
+        if isinstance(results, TestLog):
+            return results
+        test_ids = tuple(results.keys())
+        if previous is not None and previous.test_ids == test_ids:
+            test_ids = previous.test_ids  # share the tuple between steps
+        status = np.empty(len(test_ids), dtype=np.int8)
+        message_ids = np.full(len(test_ids), -1, dtype=np.int32)
+        messages = {}
+        for i, result in enumerate(results.values()):
+            status[i] = STATUS_CODES.get(result.get("status"), STATUS_CODES["error"])
+            message = result.get("message")
+            if message:
+                message = message[-max_message_chars:]
+                message_ids[i] = messages.setdefault(message, len(messages))
+        return cls(test_ids, status, message_ids, tuple(messages))
+
+    def _position(self, test_id: str) -> int:
+        if self._positions is None:
+            self._positions = {t: i for i, t in enumerate(self.test_ids)}
+        return self._positions[test_id]
+
+    def message(self, i: int) -> typing.Optional[str]:
+        return self.messages[self.message_ids[i]] if self.message_ids[i] >= 0 else None
+
+    def __getitem__(self, test_id: str) -> typing.Dict[str, str]:
+        i = self._position(test_id)
+        result = {"status": STATUSES[self.status[i]]}
+        if self.message_ids[i] >= 0:
+            result["message"] = self.message(i)
+        return result
+
+    def __iter__(self):
+        return iter(self.test_ids)
+
+    def __len__(self):
+        return len(self.test_ids)
+
+    def __repr__(self):
+        return f"TestLog({self.counts()})"
+
+    def __getstate__(self):
+        return (self.test_ids, self.status, self.message_ids, self.messages)
+
+    def __setstate__(self, state):
+        self.test_ids, self.status, self.message_ids, self.messages = state
+        self._positions = None
+
+    def counts(self) -> typing.Dict[str, int]:
+        counts = np.bincount(self.status, minlength=len(STATUSES))
+        return {s: int(c) for s, c in zip(STATUSES, counts) if c}
+
+    def num_failing(self) -> int:
+        return int(np.isin(self.status, FAILING).sum())
+
+    def diff(self, previous: typing.Optional["TestLog"]) -> typing.Dict[str, typing.List[str]]:
+        """
+        Compare with the previous run: tests that are now passing or failing, and tests that were
+        added or removed.
+        """
+        if previous is None:
+            return dict(fixed=[], broken=[], added=list(self.test_ids), removed=[])
+        if previous.test_ids is self.test_ids or previous.test_ids == self.test_ids:
+            before, after = np.isin(previous.status, FAILING), np.isin(self.status, FAILING)
+            ids = self.test_ids
+            return dict(
+                fixed=[ids[i] for i in np.flatnonzero(before & ~after)],
+                broken=[ids[i] for i in np.flatnonzero(~before & after)],
+                added=[],
+                removed=[],
+            )
+        failing_before = {t for t in previous if previous[t]["status"] in ("failed", "error")}
+        failing_after = {t for t in self if self[t]["status"] in ("failed", "error")}
+        return dict(
+            fixed=[t for t in previous.test_ids if t in failing_before and t not in failing_after],
+            broken=[t for t in self.test_ids if t in failing_after and t not in failing_before],
+            added=[t for t in self.test_ids if t not in previous],
+            removed=[t for t in previous.test_ids if t not in self],
+        )
+
+    def render_entries(
+        self,
+        previous: typing.Optional["TestLog"] = None,
+        truncate: typing.Callable[[str], str] = lambda m: m,
+    ) -> typing.List[str]:
+        """
+        Render the log for a prompt: the changes since the previous run, every failing test (with
+        its message, unless it is unchanged since the previous run) and a summary line.
+        Passing and skipped tests are only counted.
+        """
+        entries = []
+        if previous is not None:
+            changes = self.diff(previous)
+            lines = [f"{k}: {', '.join(v)}" for k, v in changes.items() if v]
+            if lines:
+                entries.append("Changes since the previous run:\n" + "\n".join(lines))
+        for i in np.flatnonzero(np.isin(self.status, FAILING)):
+            test_id, status, message = self.test_ids[i], STATUSES[self.status[i]], self.message(i)
+            if previous is not None and test_id in previous and previous[test_id] == self[test_id]:
+                entries.append(f"{test_id}: {status} (unchanged)")
+            else:
+                entries.append(f"{test_id}: {status}\n{truncate(message or '')}".rstrip())
+        summary = ", ".join(f"{n} {s}" for s, n in self.counts().items())
+        entries.append(f"Test summary: {summary or 'no tests'}")
+        return entries
+
+    def render(self, previous: typing.Optional["TestLog"] = None) -> str:
+        return "\n".join(self.render_entries(previous))
@@ -0,0 +1,337 @@
+"""
+Opt-in tracing of where the time of a run goes. Spans are nested per thread (or passed to worker
+threads with `propagate`) and can be exported as a Chrome trace (chrome://tracing, Perfetto) or as
+plain JSON. While disabled, `span` and `traced` only check a flag.
+
+Usage:
+    with tracing.session("trace.json"):
+        population.run_generation(env, reward)
+"""
+
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "Span",
+    "span",
+    "traced",
+    "propagate",
+    "current_span",
+    "enable",
+    "disable",
+    "is_enabled",
+    "clear",
+    "spans",
+    "summary",
+    "export_chrome",
+    "export_json",
+    "session",
+]
+
+_enabled = False
+_spans: typing.List["Span"] = []
+_ids = itertools.count(1)
+_current: contextvars.ContextVar[typing.Optional["Span"]] = contextvars.ContextVar(
+    "se_gym_span", default=None
+)
+
+
+class Span:
+    """
+    A timed operation. `parent_id` is the id of the enclosing span, `args` are its tags.
+    """
+
+    __slots__ = ("id", "parent_id", "name", "category", "start", "end", "thread_id", "args")
+
+    def __init__(self, name: str, category: str, args: dict, parent: typing.Optional["Span"]):
+        self.id = next(_ids)
+        self.parent_id = parent.id if parent is not None else None
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread_id = threading.get_ident()
+        self.start = self.end = None
+
+    @property
+    def duration(self) -> float:
+        """
+        Seconds, of the time so far if the span is still open.
+        """
+        end = self.end if self.end is not None else time.perf_counter_ns()
+        return (end - self.start) / 1e9
+
+    def set_tag(self, key: str, value: typing.Any):
+        self.args[key] = value
+
+    def to_dict(self) -> dict:
+        return dict(
+            id=self.id,
+            parent_id=self.parent_id,
+            name=self.name,
+            category=self.category,
+            start=self.start / 1e9,
+            duration=self.duration,
+            thread_id=self.thread_id,
+            args=self.args,
+        )
+
+
+class _NullSpan:
+    """
+    Returned by `span` while tracing is disabled.
+    """
+
+    def set_tag(self, key: str, value: typing.Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+@contextlib.contextmanager
+def _span(name: str, category: str, args: dict):
+    s = Span(name, category, args, _current.get())
+    token = _current.set(s)
+    s.start = time.perf_counter_ns()
+    try:
+        yield s
+    except BaseException as e:
+        s.args["error"] = type(e).__name__
+        raise
+    finally:
+        s.end = time.perf_counter_ns()
+        _current.reset(token)
+        _spans.append(s)  # atomic, no lock needed
+
+
+def span(name: str, category: str = "se_gym", **args):
+    """
+    Context manager recording the enclosed block as a child of the current span. `args` are stored
+    as tags, more can be added with `set_tag` on the returned span.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _span(name, category, args)
+
+
+def traced(name: typing.Optional[str] = None, category: str = "se_gym"):
+    """
+    Decorator recording every call of the function as a span, named after the function by default.
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _span(span_name, category, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def propagate(func: typing.Callable) -> typing.Callable:
+    """
+    Bind `func` to the current span, so spans it opens in a worker thread are children of it.
+    """
+    if not _enabled:
+        return func
+    parent = _current.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return wrapper
+
+
+def current_span() -> typing.Union[Span, _NullSpan]:
+    """
+    The innermost open span of this thread, to add tags from deeper code.
+    """
+    return (_current.get() if _enabled else None) or _NULL_SPAN
+
+
+class _HaystackSpan:
+    def __init__(self, span: Span):
+        self.span = span
+
+    def set_tag(self, key: str, value: typing.Any):
+        if isinstance(value, (str, int, float, bool)) or value is None:  # skip inputs and outputs
+            self.span.set_tag(key.removeprefix("haystack."), value)
+
+    def set_tags(self, tags: typing.Dict[str, typing.Any]):
+        for key, value in tags.items():
+            self.set_tag(key, value)
+
+    def set_content_tag(self, key: str, value: typing.Any):
+        pass
+
+    def raw_span(self):
+        return self.span
+
+    def get_correlation_data_for_logs(self) -> typing.Dict[str, typing.Any]:
+        return dict(span_id=self.span.id)
+
+
+def _haystack_tracer():
+    import haystack.tracing as haystack_tracing  # delayed import to avoid slow startup
+
+    class HaystackTracer(haystack_tracing.Tracer):
+        """
+        Records the spans of haystack pipelines and components as spans of this module, named after
+        the component, e.g. `component.generator`.
+        """
+
+        @contextlib.contextmanager
+        def trace(self, operation_name: str, tags: typing.Optional[typing.Dict] = None):
+            tags = tags or {}
+            name = operation_name.removeprefix("haystack.")
+            if "haystack.component.name" in tags:
+                name = f"component.{tags['haystack.component.name']}"
+            with _span(name, "haystack", {}) as s:
+                wrapped = _HaystackSpan(s)
+                wrapped.set_tags(tags)
+                yield wrapped
+
+        def current_span(self):
+            s = _current.get()
+            return _HaystackSpan(s) if s is not None else None
+
+    return HaystackTracer()
+
+
+def enable(haystack: bool = True):
+    """
+    Start recording spans. With `haystack`, the runs of haystack pipelines and their components are
+    recorded as well.
+    """
+    global _enabled
+    _enabled = True
+    if haystack:
+        import haystack.tracing as haystack_tracing  # delayed import to avoid slow startup
+
+        haystack_tracing.enable_tracing(_haystack_tracer())
+
+
+def disable():
+    """
+    Stop recording spans. Recorded spans are kept until `clear`.
+    """
+    global _enabled
+    _enabled = False
+    haystack_tracing = sys.modules.get("haystack.tracing")  # do not import haystack just for this
+    if haystack_tracing is not None:
+        haystack_tracing.disable_tracing()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def clear():
+    _spans.clear()
+
+
+def spans() -> typing.List[Span]:
+    """
+    All finished spans, in the order they ended.
+    """
+    return list(_spans)
+
+
+def summary() -> typing.Dict[str, typing.Dict[str, float]]:
+    """
+    Number of calls, total and mean seconds per span name, sorted by total time.
+    """
+    totals: typing.Dict[str, typing.List[float]] = {}
+    for s in spans():
+        totals.setdefault(s.name, []).append(s.duration)
+    return {
+        name: dict(calls=len(d), total=sum(d), mean=sum(d) / len(d))
+        for name, d in sorted(totals.items(), key=lambda x: sum(x[1]), reverse=True)
+    }
+
+
+def _write(path: str, data: dict):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, default=str)
+
+
+def export_chrome(path: str):
+    """
+    Write the spans in the Chrome trace event format, to open in chrome://tracing or Perfetto.
+    """
+    recorded = spans()
+    origin = min((s.start for s in recorded), default=0)
+    pid = os.getpid()
+    threads = {t.ident: t.name for t in threading.enumerate()}
+    events = [
+        dict(ph="M", name="thread_name", pid=pid, tid=tid, args=dict(name=threads.get(tid, tid)))
+        for tid in {s.thread_id for s in recorded}
+    ]
+    for s in recorded:
+        events.append(
+            dict(
+                name=s.name,
+                cat=s.category,
+                ph="X",
+                ts=(s.start - origin) / 1e3,
+                dur=(s.end - s.start) / 1e3,
+                pid=pid,
+                tid=s.thread_id,
+                args=dict(s.args, id=s.id, parent_id=s.parent_id),
+            )
+        )
+    _write(path, dict(traceEvents=events, displayTimeUnit="ms"))
+    logger.info(f"Wrote {len(recorded)} spans to {path}")
+
+
+def export_json(path: str):
+    """
+    Write the spans and their summary as plain JSON.
+    """
+    _write(path, dict(spans=[s.to_dict() for s in spans()], summary=summary()))
+
+
+@contextlib.contextmanager
+def session(path: typing.Optional[str] = None, chrome: bool = True, haystack: bool = True):
+    """
+    Record spans within the block and export them to `path` at the end (Chrome trace format if
+    `chrome`, else plain JSON). Spans of earlier sessions are cleared.
+    """
+    clear()
+    enable(haystack=haystack)
+    try:
+        yield
+    finally:
+        disable()
+        if path is not None:
+            (export_chrome if chrome else export_json)(path)
@@ -1,14 +1,13 @@
 from functools import wraps
-import pickle
 import logging
 from inspect import signature
 import os
-import pandas as pd
 import pathlib
 import typing
 import tempfile
 import unicodedata
-from . import config
+from .cache import DiskCache
+from . import experiment_log
 
 logger = logging.getLogger(__name__)
 
@@ -43,14 +42,21 @@ def str2path(s: typing.Any) -> str:
     raise ValueError(f"Invalid path {s}")
 
 
+_experiment_logs = {}
+
+
 def log_to_parqet(log_filename: str, **kwargs):
-    df_ = pd.DataFrame({k: [v] for k, v in kwargs.items()})
-    if os.path.exists(log_filename):
-        df = pd.read_parquet(log_filename)
-        df = pd.concat([df, df_], ignore_index=True)
-    else:
-        df = df_
-    df.to_parquet(log_filename)
+    """
+    Append one row to the experiment log `log_filename`, a directory of parquet part files written
+    in the background by `experiment_log.ExperimentLog`. Read it with `experiment_log.read` or
+    `pd.read_parquet(log_filename)`. A single parquet file written by an older version is migrated
+    into the directory first.
+    """
+    if log_filename not in _experiment_logs:
+        if os.path.isfile(log_filename):
+            experiment_log.migrate(log_filename)
+        _experiment_logs[log_filename] = experiment_log.ExperimentLog(log_filename)
+    _experiment_logs[log_filename].log(**kwargs)
 
 
 def slugify(value):
@@ -68,37 +74,27 @@ def slugify(value):
 
 
 def cached(ignore=None):
+    """
+    Cache the results of the decorated function on disk in a `cache.DiskCache`, keyed by the hash
+    of all arguments except the ones in `ignore`. The cache is available as `wrapper.cache`.
+    """
     if ignore is None:
         ignore = []
 
     def decorator(func):
-        def get_key(args, kwargs):
-            sig = signature(func)
-            bound_args = sig.bind(*args, **kwargs)
-            bound_args.apply_defaults()
-            cache_key = tuple((k, v) for k, v in bound_args.arguments.items() if k not in ignore)
-            return slugify(cache_key)
-
-        cache_file = f".cache.{func.__name__}.pkl"
-        try:
-            with open(cache_file, "rb") as f:
-                func.cache = pickle.load(f)
-                logger.debug(f"Loaded cache from {cache_file}, keys: {list(func.cache.keys())}")
-        except FileNotFoundError:
-            logger.debug(f"Cache file {cache_file} not found. Creating new cache.")
-            func.cache = {}
+        disk_cache = DiskCache(namespace=f"{func.__module__}.{func.__qualname__}")
+        sig = signature(func)
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = get_key(args, kwargs)
-            if key in func.cache:
-                return func.cache[key]
-            else:
-                func.cache[key] = result = func(*args, **kwargs)
-                with open(cache_file, "wb") as f:
-                    pickle.dump(func.cache, f)
-                return result
+            bound_args = sig.bind(*args, **kwargs)
+            bound_args.apply_defaults()
+            key = disk_cache.key(
+                *((k, v) for k, v in bound_args.arguments.items() if k not in ignore)
+            )
+            return disk_cache.get_or_compute(key, func, *args, **kwargs)
 
+        wrapper.cache = disk_cache
         return wrapper
 
     return decorator
@@ -110,24 +106,10 @@ def clear_store(store):
 
 def cache(identifier: str, func, *args, **kwargs):
     """
-    If the there is a cache file with the same identifier, its content will be returned, otherwise the function will be called and the result will be saved in a cache file for future use.
+    If the there is a cache entry with the same identifier, its content will be returned, otherwise the function will be called and the result will be saved in the cache for future use (see `cache.DiskCache`).
     """
-    if not config.CACHE_DIR:
-        return func(*args, **kwargs)
-    if not os.path.exists(config.CACHE_DIR):
-        os.makedirs(config.CACHE_DIR)
-    identifier = os.path.join(config.CACHE_DIR, f".{slugify(identifier)}.pkl")
-
-    try:
-        with open(identifier, "rb") as f:
-            logger.debug(f"Loading cache from {identifier}")
-            return pickle.load(f)
-    except FileNotFoundError:
-        logger.debug(f"Cache file {identifier} not found. Creating new cache")
-        result = func(*args, **kwargs)
-        with open(identifier, "wb") as f:
-            pickle.dump(result, f)
-        return result
+    disk_cache = DiskCache()
+    return disk_cache.get_or_compute(disk_cache.key(identifier), func, *args, **kwargs)
 
 
 def logging_setup(log_file="se_gym.log"):